@@ -30,10 +30,23 @@ format and the transformation into a tree.
 #
 # Author: Nathaniel McCallum <nathaniel@natemccallum.com>
 
+import collections
+import glob
+import json
+import os
+import re
+import threading
+import types
+import weakref
 from sys import version_info as _pyver
 
 from _augeas import ffi, lib
 
+try:
+    from collections.abc import Mapping as _Mapping, Sequence as _Sequence
+except ImportError:
+    from collections import Mapping as _Mapping, Sequence as _Sequence
+
 __author__ = "Nathaniel McCallum <nathaniel@natemccallum.com>"
 __credits__ = """Jeff Schroeder <jeffschroeder@computer.org>
 Harald Hoyer <harald@redhat.com> - initial python bindings, packaging
@@ -62,6 +75,316 @@ def dec(st):
         return b''
 
 
+def _optenc(st):
+    # Unlike enc(), keeps None apart from the empty string, as a NULL value
+    if st is None:
+        return ffi.NULL
+    return enc(st)
+
+
+# Matches the last segment of a fully qualified path, skipping over
+# escaped characters such as '\/' inside labels
+_LAST_SEGMENT = re.compile(r'/(?:[^/\\]|\\.)*$')
+
+
+def _parent_path(path):
+    m = _LAST_SEGMENT.search(path)
+    if m is None:
+        return None
+    return path[:m.start()]
+
+
+#: Statistics of the cache enabled with :func:`Augeas.enable_cache`
+CacheInfo = collections.namedtuple("CacheInfo",
+                                   "hits misses maxsize currsize")
+#: A file that :func:`Augeas.save` would write, as reported by
+#: :func:`Augeas.plan`
+FileChange = collections.namedtuple("FileChange",
+                                    "filename path old new diff")
+_MISSING = object()
+
+
+class _NullLock(object):
+    # Stands in for ThreadSafeAugeas.lock on a handle that is not shared
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_LOCK = _NullLock()
+
+# A plain label at the start of a path segment
+_LABEL = re.compile(r'(?:[^][*$()|=!,:\s\\/]|\\.)+')
+_ESCAPE = re.compile(r'\\(.)')
+# Characters that must be escaped for a label to be used in a path
+_SPECIAL = re.compile(r'([][*$()|=!,:\s\\/"\'])')
+
+
+_GLOB_SPECIAL = re.compile(r'([*?[])')
+
+
+_POSITION = re.compile(r'\[\d+\]$')
+
+
+def _family(path):
+    # Split `path` into the path of its parent and the expression matching
+    # the node and its siblings with the same label
+    parent = _parent_path(path)
+    return parent, _POSITION.sub('', path[len(parent) + 1:])
+
+
+def _glob_escape(pattern):
+    return _GLOB_SPECIAL.sub(r'[\1]', pattern)
+
+
+def _escape_label(label):
+    label = _SPECIAL.sub(r'\\\1', label)
+    if label.startswith('.'):
+        label = '\\' + label
+    return label
+
+
+def _files_path(filename):
+    """
+    Return the path of the tree of the file `filename` under :samp:`/files`,
+    with each component of the name escaped.
+    """
+    return "/files" + "/".join(_escape_label(label)
+                               for label in filename.split("/"))
+
+
+def _in_files(path):
+    # Whether the path expression `path` can only match nodes under /files;
+    # anything that can reach elsewhere, even through a predicate, counts
+    # as not
+    if path != "/files" and not path.startswith("/files/"):
+        return False
+    return not any(s in path for s in ("augeas", "$", "|", "..", "::", "["))
+
+
+def _split_expr(expr, sep):
+    # Split `expr` at the occurrences of `sep` that are not escaped and not
+    # inside brackets, parentheses or quotes
+    parts = []
+    depth = 0
+    quote = None
+    start = 0
+    i = 0
+    while i < len(expr):
+        c = expr[i]
+        if c == '\\':
+            i += 2
+            continue
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in '"\'':
+            quote = c
+        elif c in '[(':
+            depth += 1
+        elif c in '])':
+            depth -= 1
+        elif c == sep and depth == 0:
+            parts.append(expr[start:i])
+            start = i + 1
+        i += 1
+    parts.append(expr[start:])
+    return parts
+
+
+def _file_prefixes(expr):
+    """
+    Return the longest paths, relative to the root, under which the files
+    containing the nodes matched by the path expression `expr` must lie.
+    Returns :samp:`/` for expressions that could match nodes of any file,
+    and nothing for expressions that can not match anything under
+    :samp:`/files`.
+    """
+    prefixes = []
+    for alt in _split_expr(expr, '|'):
+        alt = alt.strip()
+        # Variables and relative paths refer to nodes that are already
+        # in the tree
+        if not alt.startswith('/'):
+            continue
+        segments = [seg.strip() for seg in _split_expr(alt[1:], '/')]
+        if segments[0] != 'files':
+            m = _LABEL.match(segments[0])
+            if m is None or m.end() != len(segments[0]):
+                prefixes.append('/')
+            continue
+
+        labels = []
+        for seg in segments[1:]:
+            m = _LABEL.match(seg)
+            if m is None or m.group() in ('.', '..'):
+                break
+            rest = seg[m.end():]
+            if rest and not rest.startswith('['):
+                break
+            labels.append(_ESCAPE.sub(r'\1', m.group()))
+            if rest:
+                break
+        prefixes.append('/' + '/'.join(labels))
+    return prefixes
+
+
+def _glob_regex(pattern):
+    """
+    Compile the glob `pattern` into a regular expression. Wildcards do not
+    match :samp:`/`, and a pattern that does not contain a :samp:`/` is
+    matched against the last component of a path only.
+    """
+    i, n = 0, len(pattern)
+    res = []
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == '*':
+            res.append('[^/]*')
+        elif c == '?':
+            res.append('[^/]')
+        elif c == '[':
+            j = i
+            if j < n and pattern[j] in '!^':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 1
+            if j >= n:
+                res.append('\\[')
+            else:
+                stuff = pattern[i:j].replace('\\', '\\\\')
+                i = j + 1
+                if stuff[0] in '!^':
+                    stuff = '^' + stuff[1:]
+                res.append('[%s]' % stuff)
+        elif c == '\\' and i < n:
+            res.append(re.escape(pattern[i]))
+            i += 1
+        else:
+            res.append(re.escape(c))
+    regex = ''.join(res)
+    if '/' not in pattern:
+        regex = '(?:.*/)?' + regex
+    return re.compile(regex + r'\Z')
+
+
+def _is_children(items):
+    """
+    Tell whether the list `items` describes the children of one node,
+    because all of its items are ``(label, value)`` tuples or dicts in the
+    format returned by :func:`Augeas.dump`, rather than repeated values.
+    """
+    return all((isinstance(item, tuple) and len(item) == 2 and
+                isinstance(item[0], string_types)) or
+               (isinstance(item, _Mapping) and "label" in item)
+               for item in items)
+
+
+def _to_trees(data):
+    """
+    Convert `data`, as accepted by :func:`Augeas.load_dict`, to a list of
+    dicts in the format returned by :func:`Augeas.dump`.
+    """
+    if isinstance(data, _Mapping):
+        items = data.items()
+    elif isinstance(data, (list, tuple)):
+        items = data
+    else:
+        raise TypeError("data MUST be a mapping or a list!")
+
+    trees = []
+    for item in items:
+        if isinstance(item, _Mapping):
+            # A node in the format returned by dump()
+            trees.append({"label": item["label"],
+                          "value": item.get("value"),
+                          "children": _to_trees(item.get("children") or [])})
+            continue
+        label, value = item
+        if not isinstance(label, string_types):
+            raise TypeError("label MUST be a string!")
+        values = value
+        if not isinstance(value, list) or _is_children(value):
+            values = [value]
+        for value in values:
+            if value is None or isinstance(value, string_types):
+                trees.append({"label": label, "value": value,
+                              "children": []})
+            else:
+                trees.append({"label": label, "value": None,
+                              "children": _to_trees(value)})
+    return trees
+
+
+def _xml_trees(element):
+    """
+    Convert the ``node`` children of `element`, from the output of
+    :func:`Augeas.to_xml`, to the format returned by :func:`Augeas.dump`.
+    """
+    trees = []
+    for node in element.findall("node"):
+        value = node.find("value")
+        if value is not None:
+            value = value.text or ""
+        trees.append({"label": node.get("label"), "value": value,
+                      "children": _xml_trees(node)})
+    return trees
+
+
+def _text_bytes(data, name):
+    """
+    Return `data`, a string or bytes-like object, as bytes that can be
+    passed to the library as a C string; bytes are passed through as is.
+    """
+    if isinstance(data, bytes):
+        raw = data
+    elif isinstance(data, memoryview):
+        raw = data.tobytes()
+    elif isinstance(data, bytearray):
+        raw = bytes(data)
+    elif isinstance(data, string_types):
+        raw = enc(data)
+    else:
+        raise TypeError("%s MUST be a string or bytes!" % name)
+    if b"\0" in raw:
+        raise ValueError("%s MUST not contain NUL bytes!" % name)
+    return raw
+
+
+def _free_array(array, count):
+    for i in range(count):
+        if array[i] != ffi.NULL:
+            lib.free(array[i])
+    lib.free(array)
+
+
+def _iter_array(array, count):
+    # Yields once before the first path so that the caller can start the
+    # generator right away; from then on the finally clause runs whether
+    # the generator is exhausted, closed or garbage collected
+    i = 0
+    try:
+        yield None
+        while i < count:
+            item = array[i]
+            i += 1
+            if item != ffi.NULL:
+                value = ffi.string(item)
+                lib.free(item)
+                yield dec(value)
+    finally:
+        while i < count:
+            if array[i] != ffi.NULL:
+                lib.free(array[i])
+            i += 1
+        lib.free(array)
+
+
 class AugeasIOError(IOError):
     def __init__(self, ec, fullmessage, msg, minor, details, *args):
         self.message = fullmessage
@@ -139,10 +462,19 @@ class Augeas(object):
         else:
             return dec(ffi.string(cffistr))
 
-    def _raise_error(self, errorclass, errmsg, *args):
+    def _ownedffistring(self, cffistr):
+        # Like _optffistring(), for strings the library allocated for us
+        if cffistr == ffi.NULL:
+            return None
+        try:
+            return dec(ffi.string(cffistr))
+        finally:
+            lib.free(cffistr)
+
+    def _error(self, errorclass, errmsg, *args):
         ec = lib.aug_error(self.__handle)
         if ec == Augeas.AUG_ENOMEM:
-            raise MemoryError()
+            return MemoryError()
         msg = self._optffistring(lib.aug_error_message(self.__handle))
         fullmessage = (errmsg + ": " + msg) % args
         minor = self._optffistring(lib.aug_error_minor_message(self.__handle))
@@ -151,9 +483,301 @@ class Augeas(object):
         details = self._optffistring(lib.aug_error_details(self.__handle))
         if details:
             fullmessage += ": " + details
-        raise errorclass(ec, fullmessage, msg, minor, details)
+        return errorclass(ec, fullmessage, msg, minor, details)
+
+    def _raise_error(self, errorclass, errmsg, *args):
+        raise self._error(errorclass, errmsg, *args)
+
+    def _lookup_many(self, func, name, paths, as_dict):
+        # Sanity checks, done once for the whole batch
+        if isinstance(paths, string_types):
+            raise TypeError("paths MUST be a list of strings!")
+        paths = list(paths)
+        for path in paths:
+            if not isinstance(path, string_types):
+                raise TypeError("paths MUST be a list of strings!")
+        if not self.__handle:
+            raise RuntimeError("The Augeas object has already been closed!")
+
+        if self.__lazy:
+            for path in paths:
+                self._load_lazily(path)
+
+        handle = self.__handle
+        encoded = [enc(path) for path in paths]
+
+        out = self.__value
+
+        results = []
+        for path, cpath in zip(paths, encoded):
+            ret = func(handle, cpath, out)
+            if ret < 0:
+                error = self._error(AugeasValueError,
+                                    "Augeas.%s() failed: %%s" % name, path)
+                # Only errors about the path itself belong in its slot
+                if isinstance(error, MemoryError):
+                    raise error
+                results.append(error)
+            else:
+                results.append(self._optffistring(out[0]))
+
+        if as_dict:
+            return dict(zip(paths, results))
+        return results
+
+    def _locked(self):
+        # The lock held by the helper objects (Index, Query) around their
+        # own sequences of calls on the handle
+        return _NULL_LOCK
+
+    def _define_nodeset(self, name, expr, errmsg):
+        if not self.__handle:
+            raise RuntimeError("The Augeas object has already been closed!")
+        if self.__lazy:
+            self._load_lazily(expr)
+        ret = lib.aug_defvar(self.__handle, enc(name), enc(expr))
+        if ret < 0:
+            self._raise_error(AugeasValueError, errmsg)
+        return ret
+
+    def _undefine(self, name):
+        lib.aug_defvar(self.__handle, enc(name), ffi.NULL)
 
-    def __init__(self, root=None, loadpath=None, flags=NONE):
+    def _ns_nodes(self, name, errmsg, source=False):
+        """
+        Return a list of ``(path, label, value)`` for every node in the
+        nodeset stored in the variable `name`, in document order. If `source`
+        is :py:obj:`True`, the path of the file each node belongs to is
+        appended to each tuple.
+        """
+        handle = self.__handle
+        cname = enc(name)
+
+        count = lib.aug_ns_count(handle, cname)
+        if count < 0:
+            self._raise_error(AugeasRuntimeError, errmsg)
+
+        value = self.__value
+        label = self.__label
+        path = self.__path
+        filename = self.__filename if source else ffi.NULL
+        optstr = self._optffistring
+
+        nodes = []
+        for i in range(count):
+            if lib.aug_ns_attr(handle, cname, i, value, label, filename) < 0:
+                self._raise_error(AugeasRuntimeError, errmsg)
+            if lib.aug_ns_path(handle, cname, i, path) < 0:
+                self._raise_error(AugeasRuntimeError, errmsg)
+            npath = dec(ffi.string(path[0]))
+            lib.free(path[0])
+            if source:
+                nodes.append((npath, optstr(label[0]), optstr(value[0]),
+                              optstr(filename[0])))
+                lib.free(filename[0])
+            else:
+                nodes.append((npath, optstr(label[0]), optstr(value[0])))
+        return nodes
+
+    def _match_nodes(self, path, name, source):
+        # Sanity checks
+        if not isinstance(path, string_types):
+            raise TypeError("path MUST be a string!")
+        if not self.__handle:
+            raise RuntimeError("The Augeas object has already been closed!")
+
+        errmsg = "Augeas.%s() failed" % name
+        try:
+            self._define_nodeset("_pyaug_match", path, errmsg)
+            return self._ns_nodes("_pyaug_match", errmsg, source)
+        finally:
+            self._undefine("_pyaug_match")
+
+    def _load_tree(self, path, trees):
+        """
+        Append the nodes in `trees`, a list of dicts in the format returned
+        by :func:`dump`, as the last children of the single node matching
+        `path`.
+        """
+        handle = self.__handle
+        errmsg = "Augeas._load_tree() failed"
+        self._define_nodeset("_pyaug_load", path, errmsg)
+        self.__generation += 1
+        names = set(["_pyaug_load"])
+        try:
+            # Every node is created relative to variables holding its parent
+            # or its previous sibling, so the cost of creating a node does
+            # not depend on the size of the tree or the number of siblings.
+            # Each entry holds the nodes left to create under a parent, the
+            # variable holding the parent and the one holding the last child
+            # created so far.
+            stack = [[iter(trees), "_pyaug_load", None]]
+            while stack:
+                entry = stack[-1]
+                nodes, parent, previous = entry
+                node = next(nodes, None)
+                if node is None:
+                    stack.pop()
+                    continue
+                label = node["label"]
+                value = node["value"]
+                if not label:
+                    raise ValueError("Nodes without a label can not be "
+                                     "created!")
+
+                if previous is None:
+                    name = "_pyaug_load%d_0" % len(stack)
+                    expr = "$%s/%s[last()+1]" % (parent, _escape_label(label))
+                    ret = lib.aug_defnode(
+                        handle, enc(name), enc(expr),
+                        _optenc(value), ffi.NULL)
+                else:
+                    # Insert after the previous sibling, which is the last
+                    # child, and alternate between two variables
+                    name = "_pyaug_load%d_%d" % (len(stack),
+                                                 previous.endswith("_0"))
+                    ret = lib.aug_insert(handle, enc("$" + previous),
+                                         enc(label), 0)
+                    if ret == 0:
+                        ret = lib.aug_defvar(
+                            handle, enc(name),
+                            enc("$%s/following-sibling::*[1]" % previous))
+                    if ret >= 0 and value is not None:
+                        ret = lib.aug_set(handle, enc("$" + name), enc(value))
+                if ret < 0:
+                    self._raise_error(AugeasValueError, errmsg)
+
+                names.add(name)
+                entry[2] = name
+                if node["children"]:
+                    stack.append([iter(node["children"]), name, None])
+        finally:
+            for name in names:
+                self._undefine(name)
+
+    def _transforms(self):
+        """
+        Return a ``(lens, incl, excl)`` tuple for every transform under
+        :samp:`/augeas/load`, where `incl` and `excl` are lists of globs.
+        """
+        transforms = []
+        by_path = {}
+        for path, label, value in self.match_values("/augeas/load/*/*"):
+            parent = _parent_path(path)
+            xfm = by_path.get(parent)
+            if xfm is None:
+                xfm = by_path[parent] = {"lens": None, "incl": [], "excl": []}
+                transforms.append(xfm)
+            if label == "lens":
+                xfm["lens"] = value
+            elif label in ("incl", "excl") and value:
+                xfm[label].append(value)
+        return [(xfm["lens"], xfm["incl"], xfm["excl"]) for xfm in transforms]
+
+    def _autoload_lenses(self, transforms):
+        """
+        Return `transforms`, read from this handle, with each lens
+        :samp:`@Module` replaced by :samp:`Module.lns`, which a handle
+        created with :attr:`NO_MODL_AUTOLOAD` compiles on demand.
+        :samp:`@Module` names the lens of the transform that `Module`
+        autoloads; that lens is called ``lns`` by convention only, so the
+        name is checked against the modules this handle compiled, and
+        :samp:`@Module` is kept for a module without a lens ``lns``.
+        """
+        names = {}
+        scratch = "/augeas/python/lens"
+        self.set(scratch, "")
+        try:
+            for lens in set(xfm[0] for xfm in transforms):
+                if not lens or not lens.startswith("@"):
+                    continue
+                # Storing an empty text only fails with AUG_ENOLENS if
+                # there is no such lens
+                name = lens[1:] + ".lns"
+                ret = lib.aug_text_store(self.__handle, enc(name),
+                                         enc(scratch), enc(scratch + "/tree"))
+                if ret != 0 and \
+                        lib.aug_error(self.__handle) == Augeas.AUG_ENOLENS:
+                    name = lens
+                names[lens] = name
+        finally:
+            self.remove(scratch)
+        return [(names.get(lens, lens), incl, excl)
+                for lens, incl, excl in transforms]
+
+    def _transform_files(self, prefix="/"):
+        """
+        Return ``(filename, lens)`` for every existing file under `prefix`
+        that one of the transforms would load, in the order :func:`load`
+        would load them.
+        """
+        root = self.__root
+        if prefix != "/":
+            prefix = prefix.rstrip("/") + "/"
+        files = []
+        seen = set()
+        for lens, incl, excl in self._transforms():
+            excl = [_glob_regex(pattern) for pattern in excl]
+            for pattern in incl:
+                for fspath in sorted(glob.glob(root + pattern)):
+                    name = fspath[len(root):]
+                    if name in seen or not name.startswith(prefix):
+                        continue
+                    if not os.path.isfile(fspath):
+                        continue
+                    if any(regex.match(name) for regex in excl):
+                        continue
+                    seen.add(name)
+                    files.append((name, lens))
+        return files
+
+    def _load_lazily(self, path):
+        # Only the files and directories loaded so far are remembered, not
+        # the paths, so that the bookkeeping of a long-lived handle is
+        # bounded by the files it can load
+        for prefix in _file_prefixes(path):
+            self._load_prefix(prefix)
+
+    def _load_prefix(self, prefix):
+        # Nothing to do if the prefix lies in a directory or a file that
+        # has been loaded already
+        dirs = self.__lazy_dirs
+        if "/" in dirs:
+            return
+        parent = prefix
+        while parent:
+            if parent in dirs or parent in self.__lazy_files:
+                return
+            parent = parent.rpartition("/")[0]
+
+        if prefix == "/" or os.path.isdir(self.__root + prefix):
+            for filename, lens in self._transform_files(prefix):
+                if filename not in self.__lazy_files:
+                    self._load_lazy_file(filename)
+            dirs.add(prefix)
+            return
+
+        # The prefix may continue into the tree of a file; if the first
+        # existing ancestor is a directory, the path names a new file
+        parent = prefix
+        while parent:
+            fspath = self.__root + parent
+            if os.path.isfile(fspath):
+                self._load_lazy_file(parent)
+                return
+            if os.path.exists(fspath):
+                return
+            parent = parent.rpartition("/")[0]
+
+    def _load_lazy_file(self, filename):
+        try:
+            self.load_file(filename)
+        except AugeasRuntimeError as e:
+            if e.error != Augeas.AUG_ENOLENS:
+                raise
+        self.__lazy_files.add(filename)
+
+    def __init__(self, root=None, loadpath=None, flags=NONE, lazy=False):
         """
         Initialize the library.
 
@@ -173,6 +797,12 @@ class Augeas(object):
                       :attr:`NO_STDINC`, :attr:`SAVE_NOOP`, :attr:`NO_LOAD`,
                       :attr:`NO_MODL_AUTOLOAD`, and :attr:`ENABLE_SPAN`.
         :type flags: int or :attr:`NONE`
+
+        :param lazy: do not load any files up front, as with :attr:`NO_LOAD`;
+                     instead, the first call that uses a path under
+                     :samp:`/files` loads the files that path can refer to.
+                     Files that have been loaded are not loaded again.
+        :type lazy: bool
         """
 
         # Sanity checks
@@ -183,6 +813,11 @@ class Augeas(object):
         if not isinstance(flags, int):
             raise TypeError("flag MUST be a flag!")
 
+        if lazy:
+            flags |= Augeas.NO_LOAD
+        self.__loadpath = loadpath
+        self.__flags = flags
+
         root = enc(root) if root else ffi.NULL
         loadpath = enc(loadpath) if loadpath else ffi.NULL
 
@@ -192,6 +827,258 @@ class Augeas(object):
         if not self.__handle:
             raise RuntimeError("Unable to create Augeas object!")
 
+        self.__generation = 0
+
+        # Out parameters shared by the accessors instead of being allocated
+        # on every call. Calls on a handle never overlap, ThreadSafeAugeas
+        # and AsyncAugeas serialize them, and each call reads its results
+        # before returning, so one set per handle is enough.
+        self.__value = ffi.new("char*[]", 1)
+        self.__label = ffi.new("char*[]", 1)
+        self.__path = ffi.new("char*[]", 1)
+        self.__filename = ffi.new("char*[]", 1)
+        self.__index = ffi.new("int *")
+        self.__positions = tuple(ffi.new("unsigned int *") for i in range(6))
+
+        self.__lazy = False
+        self.__lazy_files = set()
+        self.__lazy_dirs = set()
+
+        # filename -> (mtime, size, inode) when last seen by refresh() or
+        # load_file()
+        self.__file_stats = {}
+        # Whether the files were last loaded by parallel_load()
+        self.__parallel_loaded = False
+
+        # (method, path) -> result, least recently used first
+        self.__cache = None
+        self.__cache_size = 0
+        self.__cache_generation = 0
+        self.__cache_hits = 0
+        self.__cache_misses = 0
+
+        self.__indexes = weakref.WeakSet()
+
+        # Variables left defined by queries that were garbage collected
+        self.__query_names = []
+
+        # Built from /augeas/load by lens_for() when first needed
+        self.__lens_index = None
+
+        # Every attribute the accessors use must be set before this call
+        self.__root = self.get("/augeas/root").rstrip("/")
+        self.__lazy = lazy
+
+    # load path -> transforms autoloaded from it, see _autoload_transforms()
+    _autoloaded = {}
+
+    @classmethod
+    def _autoload_transforms(cls, loadpath, flags, cache_dir, compiler=None):
+        """
+        Return the ``(lens, incl, excl)`` transforms that the modules in
+        the load path autoload, as :func:`_transforms` does for a new
+        handle created with `loadpath` and the :attr:`NO_STDINC` flag of
+        `flags`, with the lenses named as :func:`_autoload_lenses` does.
+        Compiling every module is slow, so the result is kept for the life
+        of the process and, if `cache_dir` is given, in a file in it. When
+        it is not known yet, it is read from the handle returned by
+        `compiler`, which the caller then owns, or from a temporary one.
+        """
+        flags &= Augeas.NO_STDINC
+        key = (loadpath, flags, os.environ.get("AUGEAS_LENS_LIB"))
+        transforms = cls._autoloaded.get(key)
+        if transforms is not None:
+            return transforms
+
+        cache_file = None
+        if cache_dir is not None:
+            import hashlib
+            version = Augeas(loadpath=loadpath, flags=flags | Augeas.NO_LOAD |
+                             Augeas.NO_MODL_AUTOLOAD)
+            digest = hashlib.sha256(json.dumps(
+                key + (version.get("/augeas/version"),)).encode("utf8"))
+            version.close()
+            cache_file = os.path.join(
+                cache_dir, "transforms-%s.json" % digest.hexdigest())
+            try:
+                with open(cache_file) as fp:
+                    transforms = [tuple(xfm) for xfm in json.load(fp)]
+            except (IOError, OSError, ValueError):
+                pass
+
+        if transforms is None:
+            if compiler is not None:
+                aug = compiler()
+            else:
+                aug = Augeas(loadpath=loadpath, flags=flags | Augeas.NO_LOAD)
+            transforms = aug._autoload_lenses(aug._transforms())
+            if compiler is None:
+                aug.close()
+            if cache_file is not None:
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+                import tempfile
+                # Readers never see a partial file
+                fd, tmp = tempfile.mkstemp(dir=cache_dir)
+                try:
+                    with os.fdopen(fd, "w") as fp:
+                        json.dump(transforms, fp)
+                    os.rename(tmp, cache_file)
+                except Exception:
+                    os.unlink(tmp)
+                    raise
+
+        cls._autoloaded[key] = transforms
+        return transforms
+
+    @classmethod
+    def for_files(cls, paths, root=None, loadpath=None, flags=NONE,
+                  cache_dir=None):
+        """
+        Create a handle that only loads the files in `paths`, given relative
+        to the root, and only compiles the lenses they need.
+
+        The lens of each file is the one a default handle would use, see
+        :func:`lens_for`. Once the transforms are known, the handle is
+        created with :attr:`NO_MODL_AUTOLOAD`. A transform is added for
+        each file with a lens, which :func:`load` then loads unless `flags`
+        contains :attr:`NO_LOAD`. Files without a lens are left out.
+
+        Finding the lenses requires the transforms of every module, which
+        are read once per process by compiling all the modules, as a plain
+        :class:`Augeas` does; the handle that compiles them is then the one
+        returned, so the first call costs about as much as a plain
+        :class:`Augeas`, minus loading the other files. With `cache_dir`,
+        the transforms are also stored in that directory and later
+        processes skip the compilation; remove the files in it after
+        changing the modules in the load path.
+
+        An autoloaded lens :samp:`@Module` is used as :samp:`Module.lns`.
+        If a module has no lens of that name, the handle is created without
+        :attr:`NO_MODL_AUTOLOAD` so that :samp:`@Module` can be used.
+
+        :param paths: the names of the files to load
+        :type paths: list(str)
+        :param cache_dir: a directory to keep the transforms in
+        :type cache_dir: str or None
+        :rtype: :class:`Augeas`
+        """
+
+        # Sanity checks
+        if isinstance(paths, string_types):
+            raise TypeError("paths MUST be a list of strings!")
+        paths = list(paths)
+        for path in paths:
+            if not isinstance(path, string_types):
+                raise TypeError("paths MUST be a list of strings!")
+        if not isinstance(cache_dir, string_types) and cache_dir is not None:
+            raise TypeError("cache_dir MUST be a string or None!")
+
+        autoload = flags & ~Augeas.NO_MODL_AUTOLOAD | Augeas.NO_LOAD
+        compiled = []
+
+        def compiler():
+            # Finding the transforms compiles every module; the handle that
+            # does it is used as is instead of compiling the lenses again
+            compiled.append(cls(root, loadpath, autoload))
+            return compiled[0]
+
+        index = _LensIndex(
+            cls._autoload_transforms(loadpath, flags, cache_dir, compiler))
+        lenses = [(path, index.lookup(path)) for path in paths]
+        if compiled:
+            aug = compiled[0]
+            aug.clear_transforms()
+        elif any(lens and lens.startswith("@") for path, lens in lenses):
+            # Only a handle that autoloaded the module knows its @Module
+            aug = cls(root, loadpath, autoload)
+            aug.clear_transforms()
+        else:
+            aug = cls(root, loadpath,
+                      flags | Augeas.NO_LOAD | Augeas.NO_MODL_AUTOLOAD)
+        for path, lens in lenses:
+            if lens is None:
+                continue
+            if lens.startswith("@"):
+                xfm = "/augeas/load/" + _escape_label(lens[1:])
+                aug.set(xfm + "/lens", lens)
+                aug.set(xfm + "/incl[last()+1]", _glob_escape(path))
+            else:
+                aug.transform(lens, _glob_escape(path))
+        if not flags & Augeas.NO_LOAD:
+            aug.load()
+        return aug
+
+    @property
+    def generation(self):
+        """
+        A counter that is incremented by every call that may have modified the
+        tree or the variables defined on it. Two reads made while the counter
+        is unchanged see the same tree.
+
+        :rtype: int
+        """
+        return self.__generation
+
+    def enable_cache(self, maxsize=1024):
+        """
+        Remember the results of :func:`get`, :func:`label`, :func:`match`,
+        :func:`source` and :func:`span`, so that asking for the same path
+        again is a dictionary lookup. At most `maxsize` results are kept;
+        the least recently used one is dropped first.
+
+        The cache is emptied whenever :attr:`generation` changes, i.e. after
+        any call that may modify the tree. Calls that fail are not cached.
+        """
+
+        if not isinstance(maxsize, int) or maxsize < 1:
+            raise ValueError("maxsize MUST be a positive integer!")
+        self.__cache = collections.OrderedDict()
+        self.__cache_size = maxsize
+        self.__cache_generation = self.__generation
+        self.__cache_hits = 0
+        self.__cache_misses = 0
+
+    def disable_cache(self):
+        "Stop caching results and drop the ones that have been cached"
+        self.__cache = None
+        self.__cache_size = 0
+
+    def cache_info(self):
+        """
+        Return the statistics of the cache enabled with :func:`enable_cache`.
+
+        :rtype: :class:`CacheInfo`
+        """
+        return CacheInfo(self.__cache_hits, self.__cache_misses,
+                         self.__cache_size,
+                         len(self.__cache) if self.__cache is not None else 0)
+
+    def _cache_get(self, key):
+        cache = self.__cache
+        if cache is None:
+            return _MISSING
+        if self.__cache_generation != self.__generation:
+            cache.clear()
+            self.__cache_generation = self.__generation
+        try:
+            result = cache.pop(key)
+        except KeyError:
+            self.__cache_misses += 1
+            return _MISSING
+        cache[key] = result
+        self.__cache_hits += 1
+        return result
+
+    def _cache_put(self, key, result):
+        cache = self.__cache
+        if cache is None or self.__cache_generation != self.__generation:
+            return result
+        cache[key] = result
+        if len(cache) > self.__cache_size:
+            cache.popitem(last=False)
+        return result
+
     def get(self, path):
         """
         Lookup the value associated with `path`.
@@ -207,15 +1094,21 @@ class Augeas(object):
         if not self.__handle:
             raise RuntimeError("The Augeas object has already been closed!")
 
-        # Create the char * value
-        value = ffi.new("char*[]", 1)
+        if self.__lazy:
+            self._load_lazily(path)
+
+        result = self._cache_get(("get", path))
+        if result is not _MISSING:
+            return result
+
+        value = self.__value
 
         # Call the function and pass value by reference (char **)
         ret = lib.aug_get(self.__handle, enc(path), value)
         if ret < 0:
             self._raise_error(AugeasValueError, "Augeas.get() failed")
 
-        return self._optffistring(value[0])
+        return self._cache_put(("get", path), self._optffistring(value[0]))
 
     def label(self, path):
         """
@@ -232,15 +1125,52 @@ class Augeas(object):
         if not self.__handle:
             raise RuntimeError("The Augeas object has already been closed!")
 
-        # Create the char * value
-        label = ffi.new("char*[]", 1)
+        if self.__lazy:
+            self._load_lazily(path)
+
+        result = self._cache_get(("label", path))
+        if result is not _MISSING:
+            return result
+
+        label = self.__label
 
         # Call the function and pass value by reference (char **)
         ret = lib.aug_label(self.__handle, enc(path), label)
         if ret < 0:
             self._raise_error(AugeasValueError, "Augeas.label() failed")
 
-        return self._optffistring(label[0])
+        return self._cache_put(("label", path), self._optffistring(label[0]))
+
+    def get_many(self, paths, as_dict=False):
+        """
+        Lookup the values associated with each path in `paths`. This is
+        equivalent to calling :func:`get` for every path, but the arguments
+        are checked and encoded once for the whole batch.
+
+        A path that can not be looked up does not abort the batch; its slot
+        holds the :class:`AugeasValueError` describing the failure instead
+        of a value. Running out of memory raises :py:exc:`MemoryError`
+        right away.
+
+        :param paths: the paths to look up
+        :type paths: list(str)
+        :param as_dict: return a dict mapping each path to its value instead
+                        of a list in the order of `paths`
+        :type as_dict: bool
+        :rtype: list or dict
+        """
+
+        return self._lookup_many(lib.aug_get, "get_many", paths, as_dict)
+
+    def label_many(self, paths, as_dict=False):
+        """
+        Lookup the labels associated with each path in `paths`, in the same
+        way as :func:`get_many` does for values.
+
+        :rtype: list or dict
+        """
+
+        return self._lookup_many(lib.aug_label, "label_many", paths, as_dict)
 
     def set(self, path, value):
         """
@@ -257,10 +1187,37 @@ class Augeas(object):
         if not self.__handle:
             raise RuntimeError("The Augeas object has already been closed!")
 
+        self._set(path, enc(value), "Augeas.set() failed")
+
+    def clear(self, path):
+        """
+        Leave the node at `path` without a value, which is not the same as
+        an empty string and is how :func:`dump` reports the value of nodes
+        that only have children. Like :func:`set`, the node and intermediate
+        entries are created if they don't exist, and it is an error if more
+        than one node matches `path`.
+        """
+
+        # Sanity checks
+        if not isinstance(path, string_types):
+            raise TypeError("path MUST be a string!")
+        if not self.__handle:
+            raise RuntimeError("The Augeas object has already been closed!")
+
+        self._set(path, ffi.NULL, "Augeas.clear() failed")
+
+    def _set(self, path, value, errmsg):
+        # Shared by set() and clear(); `value` is already encoded
+        if self.__lazy:
+            self._load_lazily(path)
+
         # Call the function
-        ret = lib.aug_set(self.__handle, enc(path), enc(value))
+        ret = lib.aug_set(self.__handle, enc(path), value)
+        self.__generation += 1
         if ret != 0:
-            self._raise_error(AugeasValueError, "Augeas.set() failed")
+            self._raise_error(AugeasValueError, errmsg)
+        if self.__indexes:
+            self._update_indexes(self._touched(path))
 
     def setm(self, base, sub, value):
         """
@@ -281,9 +1238,13 @@ class Augeas(object):
         if not self.__handle:
             raise RuntimeError("The Augeas object has already been closed!")
 
+        if self.__lazy:
+            self._load_lazily(base)
+
         # Call the function
         ret = lib.aug_setm(
             self.__handle, enc(base), enc(sub), enc(value))
+        self.__generation += 1
         if ret < 0:
             self._raise_error(AugeasValueError, "Augeas.setm() failed")
         return ret
@@ -308,6 +1269,7 @@ class Augeas(object):
         # Call the function
         ret = lib.aug_text_store(
             self.__handle, enc(lens), enc(node), enc(path))
+        self.__generation += 1
         if ret != 0:
             self._raise_error(AugeasValueError, "Augeas.text_store() failed")
         return ret
@@ -335,11 +1297,124 @@ class Augeas(object):
         # Call the function
         ret = lib.aug_text_retrieve(
             self.__handle, enc(lens), enc(node_in), enc(path), enc(node_out))
+        self.__generation += 1
         if ret != 0:
             self._raise_error(AugeasValueError,
                               "Augeas.text_retrieve() failed")
         return ret
 
+    # Scratch nodes used by parse() and render()
+    _TEXT_SCRATCH = "/augeas/python/text"
+
+    def _text_error(self, errmsg, path):
+        # Lens failures are recorded under /augeas/text rather than in the
+        # error of the handle
+        error = self._error(AugeasValueError, errmsg)
+        if isinstance(error, MemoryError):
+            return error
+        errnode = "/augeas/text" + path + "/error"
+        try:
+            message = self.get(errnode + "/message")
+            line = self.get(errnode + "/line") if \
+                self.match(errnode + "/line") else None
+        except AugeasValueError:
+            message = None
+        if not message:
+            return error
+        if line:
+            message += " (line %s, character %s)" % (
+                line, self.get(errnode + "/char"))
+        return AugeasValueError(error.error, error.message + ": " + message,
+                                error.msg, error.minor, message)
+
+    def _text_cleanup(self):
+        lib.aug_rm(self.__handle, enc(self._TEXT_SCRATCH))
+        lib.aug_rm(self.__handle, enc("/augeas/text" + self._TEXT_SCRATCH))
+        self.__generation += 1
+
+    def parse(self, lens, data):
+        """
+        Parse `data` with the lens `lens`, e.g. ``"Hosts.lns"``, without
+        going through a file, and return the resulting tree in the format
+        returned by :func:`dump`. The handle is left as it was.
+
+        `data` can be :py:obj:`bytes`, which is handed to the library
+        without a copy, a :py:obj:`bytearray` or :py:obj:`memoryview`, or a
+        string, which is encoded as UTF-8.
+
+        :raises AugeasValueError: if `data` can not be parsed; the message
+                                  contains the error reported by the lens
+        :rtype: list(dict)
+        """
+
+        # Sanity checks
+        if not isinstance(lens, string_types):
+            raise TypeError("lens MUST be a string!")
+        raw = _text_bytes(data, "data")
+        if not self.__handle:
+            raise RuntimeError("The Augeas object has already been closed!")
+
+        text = self._TEXT_SCRATCH + "/in"
+        tree = self._TEXT_SCRATCH + "/tree"
+        try:
+            ret = lib.aug_set(self.__handle, enc(text), raw)
+            if ret == 0:
+                ret = lib.aug_text_store(
+                    self.__handle, enc(lens), enc(text), enc(tree))
+            self.__generation += 1
+            if ret != 0:
+                raise self._text_error("Augeas.parse() failed", tree)
+            return self.dump(tree + "/*")
+        finally:
+            self._text_cleanup()
+
+    def render(self, lens, tree, original=None):
+        """
+        Turn `tree` back into text with the lens `lens` and return it as
+        bytes. `tree` is anything :func:`load_dict` accepts, such as the
+        result of :func:`parse`. If `original`, a string or bytes-like
+        object, is given, the formatting of the text `tree` was parsed from
+        is kept, as :func:`save` does for files.
+
+        :raises AugeasValueError: if the lens can not render `tree`
+        :rtype: bytes
+        """
+
+        # Sanity checks
+        if not isinstance(lens, string_types):
+            raise TypeError("lens MUST be a string!")
+        raw = _text_bytes(original if original is not None else b"",
+                          "original")
+        trees = _to_trees(tree)
+        if not self.__handle:
+            raise RuntimeError("The Augeas object has already been closed!")
+
+        text = self._TEXT_SCRATCH + "/in"
+        path = self._TEXT_SCRATCH + "/tree"
+        out = self._TEXT_SCRATCH + "/out"
+        try:
+            ret = lib.aug_set(self.__handle, enc(text), raw)
+            if ret == 0:
+                ret = lib.aug_set(self.__handle, enc(path), ffi.NULL)
+            self.__generation += 1
+            if ret != 0:
+                self._raise_error(AugeasValueError, "Augeas.render() failed")
+            self._load_tree(path, trees)
+            ret = lib.aug_text_retrieve(
+                self.__handle, enc(lens), enc(text), enc(path), enc(out))
+            self.__generation += 1
+            if ret != 0:
+                raise self._text_error("Augeas.render() failed", path)
+
+            # Read the result as bytes, without decoding it
+            value = self.__value
+            if lib.aug_get(self.__handle, enc(out), value) != 1 or \
+                    value[0] == ffi.NULL:
+                self._raise_error(AugeasValueError, "Augeas.render() failed")
+            return ffi.string(value[0])
+        finally:
+            self._text_cleanup()
+
     def defvar(self, name, expr):
         """
         Define a variable `name` whose value is the result of
@@ -361,8 +1436,12 @@ class Augeas(object):
         if not self.__handle:
             raise RuntimeError("The Augeas object has already been closed!")
 
+        if self.__lazy and expr is not None:
+            self._load_lazily(expr)
+
         # Call the function
         ret = lib.aug_defvar(self.__handle, enc(name), enc(expr))
+        self.__generation += 1
         if ret < 0:
             self._raise_error(AugeasValueError, "Augeas.defvar() failed")
         return ret
@@ -389,13 +1468,133 @@ class Augeas(object):
         if not self.__handle:
             raise RuntimeError("The Augeas object has already been closed!")
 
+        if self.__lazy:
+            self._load_lazily(expr)
+
         # Call the function
         ret = lib.aug_defnode(
             self.__handle, enc(name), enc(expr), enc(value), ffi.NULL)
+        self.__generation += 1
         if ret < 0:
             self._raise_error(AugeasValueError, "Augeas.defnode() failed")
         return ret
 
+    def prepare(self, expr):
+        """
+        Register the path expression `expr` for repeated evaluation and return
+        a :class:`~augeas.query.Query` for it. The expression is evaluated
+        into a nodeset once, and only evaluated again when the tree has been
+        modified through this object in the meantime.
+
+        :rtype: :class:`~augeas.query.Query`
+        """
+
+        # Sanity checks
+        if not isinstance(expr, string_types):
+            raise TypeError("expr MUST be a string!")
+        if not self.__handle:
+            raise RuntimeError("The Augeas object has already been closed!")
+
+        # Reuse the variable of a query that was garbage collected
+        name = self.__query_names.pop() if self.__query_names else None
+        query = Query(self, expr, name)
+        try:
+            query.refresh()
+        except Exception:
+            if name is not None:
+                self.__query_names.append(name)
+            raise
+        return query
+
+    def _release_query(self, name):
+        # Called when a Query whose variable is still defined is garbage
+        # collected, possibly from another thread: keep the name for the
+        # next prepare() instead of calling into the library
+        self.__query_names.append(name)
+
+    def build_index(self, prefix, labels=None):
+        """
+        Build an :class:`~augeas.index.Index` of the nodes matching `prefix`
+        and all their descendants, which finds the nodes with a given value
+        or label without evaluating a path expression over the tree.
+
+        The index is updated incrementally by :func:`set`, :func:`remove`
+        and :func:`move`, which only look again at the nodes they touched;
+        after any other change to the tree, the index is rebuilt the next
+        time it is used.
+
+        :param prefix: the path expression matching the indexed subtrees
+        :type prefix: str
+        :param labels: only index the nodes with one of these labels
+        :type labels: list(str) or None
+        :rtype: :class:`~augeas.index.Index`
+        """
+
+        # Sanity checks
+        if not isinstance(prefix, string_types):
+            raise TypeError("prefix MUST be a string!")
+        if labels is not None and (
+                isinstance(labels, string_types) or
+                not all(isinstance(label, string_types) for label in labels)):
+            raise TypeError("labels MUST be a list of strings!")
+        if not self.__handle:
+            raise RuntimeError("The Augeas object has already been closed!")
+
+        index = Index(self, prefix, labels)
+        index.rebuild()
+        self.__indexes.add(index)
+        return index
+
+    def transaction(self, save=True):
+        """
+        Return a :class:`~augeas.transaction.Transaction` that queues changes
+        to the tree and applies them all at once::
+
+            with aug.transaction() as tx:
+                tx.set("/files/etc/hosts/1/ipaddr", "127.0.0.2")
+                tx.remove("/files/etc/hosts/2")
+
+        If applying a change fails, or the changed files can not be saved,
+        the tree is restored to its state before the transaction and the
+        exception is raised again.
+
+        :param save: whether to :func:`save` the tree after the changes have
+                     been applied and validated
+        :type save: bool
+        :rtype: :class:`~augeas.transaction.Transaction`
+        """
+
+        # Sanity checks
+        if not isinstance(save, bool):
+            raise TypeError("save MUST be a boolean!")
+        if not self.__handle:
+            raise RuntimeError("The Augeas object has already been closed!")
+
+        return Transaction(self, save)
+
+    def _apply(self, operations):
+        # Make the changes queued in a Transaction. Indexes are not updated
+        # after each change, which would read the touched nodes again every
+        # time; the changed generation makes them rebuild once, when they
+        # are next used
+        indexes, self.__indexes = self.__indexes, weakref.WeakSet()
+        try:
+            for name, args, kwargs in operations:
+                getattr(self, name)(*args, **kwargs)
+        finally:
+            self.__indexes = indexes
+
+    def _touched(self, path):
+        # The nodes matching `path`, or None if that is not known
+        try:
+            return self.match(path) or None
+        except AugeasRuntimeError:
+            return None
+
+    def _update_indexes(self, paths):
+        for index in list(self.__indexes):
+            index._update(paths)
+
     def move(self, src, dst):
         """
         Move the node `src` to `dst`. `src` must match exactly one node
@@ -413,10 +1612,20 @@ class Augeas(object):
         if not self.__handle:
             raise RuntimeError("The Augeas object has already been closed!")
 
+        if self.__lazy:
+            self._load_lazily(src)
+            self._load_lazily(dst)
+
+        touched = self._touched(src) if self.__indexes else None
+
         # Call the function
         ret = lib.aug_mv(self.__handle, enc(src), enc(dst))
+        self.__generation += 1
         if ret != 0:
             self._raise_error(AugeasValueError, "Augeas.move() failed")
+        if touched is not None:
+            moved = self._touched(dst)
+            self._update_indexes(touched + moved if moved else None)
 
     def copy(self, src, dst):
         """
@@ -435,8 +1644,13 @@ class Augeas(object):
         if not self.__handle:
             raise RuntimeError("The Augeas object has already been closed!")
 
+        if self.__lazy:
+            self._load_lazily(src)
+            self._load_lazily(dst)
+
         # Call the function
         ret = lib.aug_cp(self.__handle, enc(src), enc(dst))
+        self.__generation += 1
         if ret != 0:
             self._raise_error(AugeasValueError, "Augeas.copy() failed")
 
@@ -453,8 +1667,12 @@ class Augeas(object):
         if not self.__handle:
             raise RuntimeError("The Augeas object has already been closed!")
 
+        if self.__lazy:
+            self._load_lazily(src)
+
         # Call the function
         ret = lib.aug_rename(self.__handle, enc(src), enc(dst))
+        self.__generation += 1
         if ret < 0:
             self._raise_error(AugeasValueError, "Augeas.rename() failed")
         return ret
@@ -478,9 +1696,13 @@ class Augeas(object):
         if not self.__handle:
             raise RuntimeError("The Augeas object has already been closed!")
 
+        if self.__lazy:
+            self._load_lazily(path)
+
         # Call the function
         ret = lib.aug_insert(self.__handle, enc(path),
                              enc(label), before and 1 or 0)
+        self.__generation += 1
         if ret != 0:
             self._raise_error(AugeasValueError, "Augeas.insert() failed")
 
@@ -497,8 +1719,17 @@ class Augeas(object):
         if not self.__handle:
             raise RuntimeError("The Augeas object has already been closed!")
 
+        if self.__lazy:
+            self._load_lazily(path)
+
+        touched = self._touched(path) if self.__indexes else None
+
         # Call the function
-        return lib.aug_rm(self.__handle, enc(path))
+        ret = lib.aug_rm(self.__handle, enc(path))
+        self.__generation += 1
+        if touched is not None:
+            self._update_indexes(touched)
+        return ret
 
     def match(self, path):
         """
@@ -519,31 +1750,303 @@ class Augeas(object):
         segment.
         """
 
+        if isinstance(path, string_types):
+            result = self._cache_get(("match", path))
+            if result is not _MISSING:
+                return list(result)
+
+        array, count = self._match_array(path, "match")
+
+        # Loop through the string array
+        matches = []
+        for i in range(count):
+            if array[i] != ffi.NULL:
+                # Create a python string and append it to our matches list
+                item = ffi.string(array[i])
+                matches.append(dec(item))
+                lib.free(array[i])
+        lib.free(array)
+        self._cache_put(("match", path), tuple(matches))
+        return matches
+
+    def match_values(self, path):
+        """
+        Return a ``(path, label, value)`` tuple for every node matching the
+        path expression `path`. The result is the same as calling
+        :func:`label` and :func:`get` on every path returned by :func:`match`,
+        but `path` is evaluated only once and no further path expressions are
+        evaluated.
+
+        :rtype: list(tuple(str, str, str))
+        """
+
+        return self._match_nodes(path, "match_values", False)
+
+    def match_attrs(self, path):
+        """
+        Like :func:`match_values`, but each tuple has a fourth element with
+        the path of the file the node belongs to, as returned by
+        :func:`source`, or :py:obj:`None` if it does not belong to a file.
+
+        :rtype: list(tuple(str, str, str, str))
+        """
+
+        return self._match_nodes(path, "match_attrs", True)
+
+    def dump(self, path):
+        """
+        Return the subtrees of all nodes matching `path` as a list of nested
+        dicts. Each dict has the keys ``label``, ``value`` and ``children``,
+        the latter being a list of dicts of the same form.
+
+        The whole subtree is read from a single nodeset, which avoids
+        evaluating a path expression for every node as :func:`match` followed
+        by :func:`get` would.
+
+        :rtype: list(dict)
+        """
+
+        # Sanity checks
+        if not isinstance(path, string_types):
+            raise TypeError("path MUST be a string!")
+        if not self.__handle:
+            raise RuntimeError("The Augeas object has already been closed!")
+
+        errmsg = "Augeas.dump() failed"
+        try:
+            self._define_nodeset("_pyaug_top", path, errmsg)
+            self._define_nodeset("_pyaug_all",
+                                 "$_pyaug_top/descendant-or-self::*", errmsg)
+            nodes = self._ns_nodes("_pyaug_all", errmsg)
+        finally:
+            self._undefine("_pyaug_top")
+            self._undefine("_pyaug_all")
+
+        # Nodes come in document order, so a parent is always seen before
+        # its children
+        trees = []
+        seen = {}
+        for npath, label, value in nodes:
+            node = {"label": label, "value": value, "children": []}
+            parent = seen.get(_parent_path(npath))
+            if parent is None:
+                trees.append(node)
+            else:
+                parent["children"].append(node)
+            seen[npath] = node
+        return trees
+
+    def load_dict(self, path, data):
+        """
+        Append the nodes described by `data` as children of the node at
+        `path`, which is created if it does not exist yet. `data` is either
+
+        * a mapping from labels to values: a string or :py:obj:`None` makes
+          a leaf with that value, and a mapping makes a node without a value
+          whose children are described by it. A list whose items are all
+          ``(label, value)`` tuples or dicts in the format returned by
+          :func:`dump` also makes a single node with those children; any
+          other list makes one node with that label for each of its items,
+          which are strings, :py:obj:`None`, mappings or lists of children;
+        * a list of ``(label, value)`` pairs, with values as above, which
+          allows repeating labels and keeps the order of the nodes;
+        * a list of dicts in the format returned by :func:`dump`, which also
+          allows nodes that have both a value and children.
+
+        For example, ``load_dict("/files/etc/hosts", {"1": {"ipaddr":
+        "127.0.0.1", "canonical": "localhost", "alias": ["lh", "lo"]}})``.
+
+        Each node is created relative to its parent or previous sibling, so
+        the cost of adding a node stays the same however many siblings it
+        has, unlike a sequence of :func:`set` calls with growing paths.
+        """
+
         # Sanity checks
         if not isinstance(path, string_types):
             raise TypeError("path MUST be a string!")
         if not self.__handle:
             raise RuntimeError("The Augeas object has already been closed!")
 
+        trees = _to_trees(data)
+        if not self.match(path):
+            self.clear(path)
+        self._load_tree(path, trees)
+
+    def to_xml(self, path, tree=False):
+        """
+        Serialize the nodes matching `path` and their descendants to XML.
+        The whole subtree is converted and serialized by the library and
+        libxml2, without a call per node.
+
+        The document has an ``augeas`` root element; every node is a
+        ``node`` element with a ``label`` attribute, a ``value`` child
+        element if it has a value, and a ``node`` element for each child.
+
+        :param tree: return a parsed element instead of bytes, from
+                     :mod:`lxml.etree` if it is installed and from
+                     :mod:`xml.etree.ElementTree` otherwise
+        :type tree: bool
+        :rtype: bytes or Element
+        """
+
+        # Sanity checks
+        if not isinstance(path, string_types):
+            raise TypeError("path MUST be a string!")
+        if not self.__handle:
+            raise RuntimeError("The Augeas object has already been closed!")
+
+        if self.__lazy:
+            self._load_lazily(path)
+
+        xmldoc = ffi.new("xmlNode **")
+        ret = lib.aug_to_xml(self.__handle, enc(path), xmldoc, 0)
+        if ret < 0:
+            self._raise_error(AugeasRuntimeError, "Augeas.to_xml() failed")
+
+        buf = lib.xmlBufferCreate()
+        try:
+            if buf == ffi.NULL or \
+                    lib.xmlNodeDump(buf, ffi.NULL, xmldoc[0], 0, 0) < 0:
+                raise MemoryError()
+            data = ffi.buffer(lib.xmlBufferContent(buf),
+                              lib.xmlBufferLength(buf))[:]
+        finally:
+            if buf != ffi.NULL:
+                lib.xmlBufferFree(buf)
+            lib.xmlFreeNode(xmldoc[0])
+
+        if tree:
+            try:
+                from lxml import etree
+            except ImportError:
+                from xml.etree import ElementTree as etree
+            return etree.fromstring(data)
+        return data
+
+    def to_json(self, path, **kwargs):
+        """
+        Serialize the nodes matching `path` and their descendants to JSON,
+        as the list returned by :func:`dump` would be. The tree is read with
+        :func:`to_xml`; keyword arguments are passed to :func:`json.dumps`.
+
+        :rtype: str
+        """
+
+        from xml.etree import ElementTree
+        trees = _xml_trees(ElementTree.fromstring(self.to_xml(path)))
+        return json.dumps(trees, **kwargs)
+
+    def print_tree(self, path, out=None):
+        """
+        Print the nodes matching `path` and their descendants, one
+        ``path = "value"`` line per node, the way :command:`augtool print`
+        does. The lines are written to the file `out` if it is given, and
+        returned as a string otherwise.
+
+        :rtype: str or None
+        """
+
+        # Sanity checks
+        if not isinstance(path, string_types):
+            raise TypeError("path MUST be a string!")
+        if out is not None and not hasattr(out, 'write'):
+            raise TypeError("out MUST be a file!")
+        if not self.__handle:
+            raise RuntimeError("The Augeas object has already been closed!")
+
+        if self.__lazy:
+            self._load_lazily(path)
+
+        if out is not None:
+            ret = lib.aug_print(self.__handle, out, enc(path))
+            if ret < 0:
+                self._raise_error(AugeasRuntimeError,
+                                  "Augeas.print_tree() failed")
+            return None
+
+        text = ffi.new("char **")
+        size = ffi.new("size_t *")
+        stream = lib.open_memstream(text, size)
+        if stream == ffi.NULL:
+            raise MemoryError()
+        try:
+            ret = lib.aug_print(self.__handle, stream, enc(path))
+        finally:
+            lib.fclose(stream)
+            result = ffi.buffer(text[0], size[0])[:]
+            lib.free(text[0])
+        if ret < 0:
+            self._raise_error(AugeasRuntimeError, "Augeas.print_tree() failed")
+        return result.decode(AUGENC)
+
+    def escape_name(self, name):
+        """
+        Escape the characters of `name` that have a special meaning in path
+        expressions, so that the result can be used as a label in a path.
+
+        :rtype: str
+        """
+
+        # Sanity checks
+        if not isinstance(name, string_types):
+            raise TypeError("name MUST be a string!")
+        if not self.__handle:
+            raise RuntimeError("The Augeas object has already been closed!")
+
+        out = self.__value
+        ret = lib.aug_escape_name(self.__handle, enc(name), out)
+        if ret < 0:
+            self._raise_error(AugeasRuntimeError,
+                              "Augeas.escape_name() failed")
+        # The library leaves out NULL when there is nothing to escape
+        if out[0] == ffi.NULL:
+            return name
+        return self._ownedffistring(out[0])
+
+    def _match_array(self, path, name):
+        # Sanity checks
+        if not isinstance(path, string_types):
+            raise TypeError("path MUST be a string!")
+        if not self.__handle:
+            raise RuntimeError("The Augeas object has already been closed!")
+
+        if self.__lazy:
+            self._load_lazily(path)
+
         parray = ffi.new('char***')
 
         ret = lib.aug_match(self.__handle, enc(path), parray)
         if ret < 0:
             self._raise_error(AugeasRuntimeError,
-                              "Augeas.match() failed: %s", path)
+                              "Augeas.%s() failed: %%s" % name, path)
+        return parray[0], ret
 
-        # Loop through the string array
-        array = parray[0]
-        matches = []
-        for i in range(ret):
-            if array[i] != ffi.NULL:
-                # Create a python string and append it to our matches list
-                item = ffi.string(array[i])
-                matches.append(dec(item))
-                lib.free(array[i])
-        lib.free(array)
+    def iter_match(self, path):
+        """
+        Return an iterator over the matches of the path expression `path`,
+        like :func:`match`. The expression is evaluated right away, but each
+        path is only decoded when the iterator reaches it, and freed
+        immediately after. Paths that have not been reached are freed when the
+        iterator is exhausted, closed or garbage collected.
+        """
+
+        array, count = self._match_array(path, "iter_match")
+        matches = _iter_array(array, count)
+        next(matches)
         return matches
 
+    def lazy_match(self, path):
+        """
+        Return the matches of the path expression `path` as a
+        :class:`MatchResult`, which keeps the array returned by the library
+        and only decodes a path when it is accessed.
+
+        :rtype: MatchResult
+        """
+
+        array, count = self._match_array(path, "lazy_match")
+        return MatchResult(array, count)
+
     def span(self, path):
         """
         Get the span according to input file of the node associated with
@@ -561,26 +2064,24 @@ class Augeas(object):
         if not self.__handle:
             raise RuntimeError("The Augeas object has already been closed!")
 
-        # TODO: Rewrite this
+        if self.__lazy:
+            self._load_lazily(path)
 
-        filename = ffi.new('char **')
-        label_start = ffi.new('unsigned int *')
-        label_end = ffi.new('unsigned int *')
-        value_start = ffi.new('unsigned int *')
-        value_end = ffi.new('unsigned int *')
-        span_start = ffi.new('unsigned int *')
-        span_end = ffi.new('unsigned int *')
+        result = self._cache_get(("span", path))
+        if result is not _MISSING:
+            return result
 
-        ret = lib.aug_span(self.__handle, enc(path), filename,
-                           label_start, label_end,
-                           value_start, value_end,
-                           span_start, span_end)
+        filename = self.__filename
+        positions = self.__positions
+
+        # positions are label_start, label_end, value_start, value_end,
+        # span_start and span_end
+        ret = lib.aug_span(self.__handle, enc(path), filename, *positions)
         if (ret < 0):
             self._raise_error(AugeasValueError, "Augeas.span() failed")
-        fname = self._optffistring(filename[0])
-        return (fname, int(label_start[0]), int(label_end[0]),
-                int(value_start[0]), int(value_end[0]),
-                int(span_start[0]), int(span_end[0]))
+        fname = self._ownedffistring(filename[0])
+        return self._cache_put(("span", path), (fname,) + tuple(
+            int(position[0]) for position in positions))
 
     def save(self):
         """
@@ -600,12 +2101,77 @@ class Augeas(object):
         # Sanity checks
         if not self.__handle:
             raise RuntimeError("The Augeas object has already been closed!")
+        if self.__parallel_loaded and self.get("/augeas/save") != "noop":
+            raise RuntimeError("Call load() before saving a tree built by "
+                               "parallel_load()!")
 
         # Call the function
         ret = lib.aug_save(self.__handle)
+        self.__generation += 1
         if ret != 0:
             self._raise_error(AugeasIOError, "Augeas.save() failed")
 
+    def _dry_save(self):
+        # Save with /augeas/save set to noop, and return the error of the
+        # save, or None if every modified file could be written. The mode is
+        # switched with raw calls and the generation is left alone: a noop
+        # save only records events and errors under /augeas, so only the
+        # cached results that can involve those nodes are dropped
+        handle = self.__handle
+        value = self.__value
+        if lib.aug_get(handle, b"/augeas/save", value) < 0:
+            self._raise_error(AugeasValueError, "Augeas.save() failed")
+        mode = ffi.string(value[0]) if value[0] != ffi.NULL else ffi.NULL
+        if lib.aug_set(handle, b"/augeas/save", b"noop") != 0:
+            self._raise_error(AugeasValueError, "Augeas.save() failed")
+        try:
+            error = None
+            if lib.aug_save(handle) != 0:
+                error = self._error(AugeasIOError, "Augeas.save() failed")
+        finally:
+            lib.aug_set(handle, b"/augeas/save", mode)
+
+        cache = self.__cache
+        if cache is not None:
+            for key in list(cache):
+                if not _in_files(key[1]):
+                    del cache[key]
+        return error
+
+    def plan(self):
+        """
+        Report what :func:`save` would write, without writing anything.
+        The tree is saved with :samp:`/augeas/save` set to ``noop``, which
+        lists the files that would be written under
+        :samp:`/augeas/events/saved`; the new contents of each are rendered
+        with :func:`preview` and compared with the contents on disk. The
+        save mode is restored afterwards without invalidating the results
+        of :func:`enable_cache`, queries or indexes.
+
+        :returns: one entry per file, in the order :func:`save` would write
+                  them; `old` is :py:obj:`None` for a new file, `new` for a
+                  file that would be deleted, and `diff` is a unified diff
+        :rtype: list(:class:`FileChange`)
+        """
+
+        # Sanity checks
+        if not self.__handle:
+            raise RuntimeError("The Augeas object has already been closed!")
+
+        error = self._dry_save()
+        if error is not None:
+            raise error
+
+        changes = []
+        for path, label, node in self.match_values("/augeas/events/saved"):
+            if not node or not node.startswith("/files/"):
+                continue
+            filename = node[len("/files"):]
+            new = self.preview(node) if self.match(node) else None
+            changes.append(_plan_file(filename, self.__root + filename,
+                                      node, new))
+        return changes
+
     def load(self):
         """
         Load files into the tree. Which files to load and what lenses to use
@@ -638,8 +2204,92 @@ class Augeas(object):
             raise RuntimeError("The Augeas object has already been closed!")
 
         ret = lib.aug_load(self.__handle)
+        self.__generation += 1
+        self.__file_stats.clear()
+        self.__parallel_loaded = False
+        self.__lens_index = None
         if ret != 0:
             self._raise_error(AugeasRuntimeError, "Augeas.load() failed")
+        if self.__lazy:
+            self.__lazy_dirs.add("/")
+
+    def parallel_load(self, workers=None):
+        """
+        Parse the files :func:`load` would load in `workers` processes,
+        for a handle whose tree is only read. The files the transforms apply
+        to are divided between the workers, each of which parses its share
+        with a handle of its own and sends the resulting trees back; they
+        are then added to this handle in the order :func:`load` would have
+        loaded them.
+
+        The trees are the same as after :func:`load`, including the entries
+        under :samp:`/augeas/files`, but they are rebuilt through the API,
+        so the library considers every file modified. Saving would write
+        all of them back, leaving :samp:`.augsave` or :samp:`.augnew` files
+        next to each with :attr:`SAVE_BACKUP` or :attr:`SAVE_NEWFILE`, and
+        the library offers no way to clear that state. This is therefore
+        not a replacement for :func:`load` on a handle that is saved:
+        :func:`save` raises :py:exc:`RuntimeError` until :func:`load` is
+        called again. Changes to the lenses made through :func:`defvar` or
+        in the tree are not seen by the workers.
+
+        :param workers: the number of processes to use, or :py:obj:`None` to
+                        use one per CPU
+        :type workers: int or None
+        """
+
+        # Sanity checks
+        if workers is not None and (not isinstance(workers, int) or
+                                    workers < 1):
+            raise ValueError("workers MUST be a positive integer!")
+        if not self.__handle:
+            raise RuntimeError("The Augeas object has already been closed!")
+
+        import multiprocessing
+        files = self._transform_files()
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = min(workers, len(files))
+        if workers < 2:
+            self.load()
+            return
+
+        root = self.get("/augeas/root")
+        shards = [(root, self.__loadpath, self.__flags, files[i::workers])
+                  for i in range(workers)]
+        pool = multiprocessing.Pool(workers)
+        try:
+            parsed = {}
+            for result in pool.map(_parallel_load_shard, shards):
+                parsed.update(result)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        self.remove("/files/*")
+        self.remove("/augeas/files/*")
+        self.__parallel_loaded = True
+        for filename, lens in files:
+            trees = parsed.get(filename)
+            if trees is None:
+                # The worker could not send the tree back
+                self.load_file(filename)
+                continue
+            node = _files_path(filename)
+            for path, nodes in zip((node, "/augeas" + node), trees):
+                for tree in nodes:
+                    # None must stay a NULL value, as load() leaves it
+                    ret = lib.aug_set(self.__handle, enc(path),
+                                      _optenc(tree["value"]))
+                    self.__generation += 1
+                    if ret != 0:
+                        self._raise_error(AugeasValueError,
+                                          "Augeas.parallel_load() failed")
+                    self._load_tree(path, tree["children"])
+
+        self.__file_stats.clear()
+        if self.__lazy:
+            self.__lazy_dirs.add("/")
 
     def load_file(self, filename):
         # Sanity checks
@@ -649,8 +2299,105 @@ class Augeas(object):
             raise RuntimeError("The Augeas object has already been closed!")
 
         ret = lib.aug_load_file(self.__handle, enc(filename))
+        self.__generation += 1
         if ret != 0:
             self._raise_error(AugeasRuntimeError, "Augeas.load_file() failed")
+        if self.__lazy:
+            self.__lazy_files.add(filename)
+        # So that refresh() does not load the file again
+        try:
+            st = os.stat(self.__root + filename)
+        except OSError:
+            self.__file_stats.pop(filename, None)
+        else:
+            self.__file_stats[filename] = (st.st_mtime, st.st_size, st.st_ino)
+
+    def _tracked_files(self):
+        # Map the name of every file recorded under /augeas/files to the
+        # path of its metadata node and its modification time
+        info = {}
+        for path, label, value in self.match_values(
+                "/augeas/files//*[mtime]/path"):
+            if value and value.startswith("/files/"):
+                info[_parent_path(path)] = [value[len("/files"):], None]
+        for path, label, value in self.match_values(
+                "/augeas/files//*[path]/mtime"):
+            entry = info.get(_parent_path(path))
+            if entry is not None:
+                entry[1] = value
+        return dict((filename, (path, mtime))
+                    for path, (filename, mtime) in info.items())
+
+    def refresh(self, files=None):
+        """
+        Bring the tree up to date with the files on disk without reloading
+        everything like :func:`load` does. Every file recorded under
+        :samp:`/augeas/files` is checked: files whose modification time,
+        size or inode changed since they were loaded are loaded again with
+        :func:`load_file`, and files that no longer exist are removed from
+        the tree. Changes made to the tree of a reloaded file are lost.
+
+        The first check of a file relies on the modification time recorded
+        by the library; later ones also compare size and inode, which
+        catches changes made within the same second.
+
+        :param files: only check these files, given by their name relative
+                      to the root, e.g. ``/etc/hosts``; files that are not
+                      in the tree are ignored
+        :type files: list(str) or None
+        :returns: the names of the files that were reloaded or removed
+        :rtype: list(str)
+        """
+
+        # Sanity checks
+        if files is not None:
+            if isinstance(files, string_types):
+                raise TypeError("files MUST be a list of strings!")
+            files = list(files)
+            if not all(isinstance(f, string_types) for f in files):
+                raise TypeError("files MUST be a list of strings!")
+        if not self.__handle:
+            raise RuntimeError("The Augeas object has already been closed!")
+
+        tracked = self._tracked_files()
+        if files is None:
+            files = tracked
+        stats = self.__file_stats
+        changed = []
+        for filename in sorted(set(files)):
+            if filename not in tracked:
+                continue
+            info, mtime = tracked[filename]
+            node = _files_path(filename)
+            try:
+                st = os.stat(self.__root + filename)
+            except OSError:
+                self.remove(node)
+                self.remove(info)
+                stats.pop(filename, None)
+                changed.append(filename)
+                continue
+
+            current = (st.st_mtime, st.st_size, st.st_ino)
+            previous = stats.get(filename)
+            if previous is None:
+                try:
+                    modified = int(mtime) != int(st.st_mtime)
+                except (TypeError, ValueError):
+                    modified = True
+            else:
+                modified = previous != current
+
+            if modified:
+                # Drop the file completely so that the library can not
+                # consider its tree current
+                self.remove(node)
+                self.remove(info)
+                self.load_file(filename)
+                changed.append(filename)
+            else:
+                stats[filename] = current
+        return changed
 
     def source(self, path):
         # Sanity checks
@@ -659,14 +2406,21 @@ class Augeas(object):
         if not self.__handle:
             raise RuntimeError("The Augeas object has already been closed!")
 
-        # Create the char * value
-        value = ffi.new("char*[]", 1)
+        if self.__lazy:
+            self._load_lazily(path)
+
+        result = self._cache_get(("source", path))
+        if result is not _MISSING:
+            return result
+
+        value = self.__filename
 
         ret = lib.aug_source(self.__handle, enc(path), value)
         if ret != 0:
             self._raise_error(AugeasRuntimeError, "Augeas.source() failed")
 
-        return self._optffistring(value[0])
+        return self._cache_put(("source", path),
+                               self._ownedffistring(value[0]))
 
     def srun(self, out, command):
         # Sanity checks
@@ -678,6 +2432,7 @@ class Augeas(object):
             raise RuntimeError("The Augeas object has already been closed!")
 
         ret = lib.aug_srun(self.__handle, out, enc(command))
+        self.__generation += 1
         if ret < 0:
             self._raise_error(AugeasRuntimeError,
                               "Augeas.srun() failed (%d)", ret)
@@ -689,13 +2444,15 @@ class Augeas(object):
         if not self.__handle:
             raise RuntimeError("The Augeas object has already been closed!")
 
-        # Create the char * value
-        out = ffi.new("char*[]", 1)
+        if self.__lazy:
+            self._load_lazily(path)
+
+        out = self.__value
 
         ret = lib.aug_preview(self.__handle, enc(path), out)
         if ret < 0:
             self._raise_error(AugeasRuntimeError, "Augeas.preview() failed")
-        return self._optffistring(out[0])
+        return self._ownedffistring(out[0])
 
     def ns_attr(self, name, index):
         # Sanity checks
@@ -703,15 +2460,17 @@ class Augeas(object):
             raise TypeError("name MUST be a string!")
         if not isinstance(index, int):
             raise TypeError("index MUST be an integer!")
-        value = ffi.new("char*[]", 1)
-        label = ffi.new("char*[]", 1)
-        file_path  = ffi.new("char*[]", 1)
+        value = self.__value
+        label = self.__label
+        file_path = self.__filename
 
-        ret = lib.aug_ns_attr(self.__handle, enc(name), index, value, label, file_path)
+        ret = lib.aug_ns_attr(self.__handle, enc(name), index, value, label,
+                              file_path)
         if ret < 0:
             self._raise_error(AugeasRuntimeError, "Augeas.ns_attr() failed")
 
-        return (self._optffistring(value[0]), self._optffistring(label[0]), self._optffistring(file_path[0]) )
+        return (self._optffistring(value[0]), self._optffistring(label[0]),
+                self._ownedffistring(file_path[0]))
 
     def ns_label(self, name, index):
         # Sanity checks
@@ -720,9 +2479,8 @@ class Augeas(object):
         if not isinstance(index, int):
             raise TypeError("index MUST be an integer!")
 
-        # Create the char * value
-        label = ffi.new("char*[]", 1)
-        labelindex = ffi.new("int*", 1)
+        label = self.__label
+        labelindex = self.__index
 
         ret = lib.aug_ns_label(self.__handle, enc(name), index, label, labelindex)
 
@@ -738,8 +2496,7 @@ class Augeas(object):
         if not isinstance(index, int):
             raise TypeError("index MUST be an integer!")
 
-        # Create the char * value
-        value = ffi.new("char*[]", 1)
+        value = self.__value
 
         ret = lib.aug_ns_value(self.__handle, enc(name), index, value)
         if ret < 0:
@@ -763,14 +2520,40 @@ class Augeas(object):
         if not isinstance(index, int):
             raise TypeError("index MUST be an integer!")
 
-        # Create the char * value
-        path = ffi.new("char*[]", 1)
+        path = self.__path
 
         ret = lib.aug_ns_path(self.__handle, enc(name), index, path)
         if ret < 0:
             self._raise_error(AugeasRuntimeError, "Augeas.ns_path() failed")
-        return self._optffistring(path[0])
+        return self._ownedffistring(path[0])
+
+
+    def lens_for(self, filename):
+        """
+        Return the lens that :func:`load` would use for `filename`, a path
+        relative to the root, in the form accepted by :func:`parse` such as
+        ``"Hosts.lns"``, or :py:obj:`None` if no transform applies to it.
+        The file does not have to exist.
+
+        The transforms under :samp:`/augeas/load` are compiled into an index
+        on the first call. It is built again after :func:`transform`,
+        :func:`add_transform`, :func:`clear_transforms` or :func:`load`;
+        call one of them after changing :samp:`/augeas/load` with
+        :func:`set` or :func:`remove`.
+
+        :rtype: str or None
+        """
 
+        # Sanity checks
+        if not isinstance(filename, string_types):
+            raise TypeError("filename MUST be a string!")
+        if not self.__handle:
+            raise RuntimeError("The Augeas object has already been closed!")
+
+        if self.__lens_index is None:
+            self.__lens_index = _LensIndex(self._transforms())
+        lens = self.__lens_index.lookup(filename)
+        return _lens_name(lens) if lens is not None else None
 
     def clear_transforms(self):
         """
@@ -778,6 +2561,7 @@ class Augeas(object):
         called right after this, there will be no files beneath :samp:`/files`.
         """
         self.remove("/augeas/load/*")
+        self.__lens_index = None
 
     def add_transform(self, lens, incl, name=None, excl=()):
         """
@@ -827,6 +2611,8 @@ class Augeas(object):
             raise RuntimeError("The Augeas object has already been closed!")
 
         ret = lib.aug_transform(self.__handle, enc(lens), enc(file), excl)
+        self.__generation += 1
+        self.__lens_index = None
         if ret != 0:
             self._raise_error(AugeasRuntimeError, "Augeas.transform() failed")
 
@@ -837,15 +2623,188 @@ class Augeas(object):
         for any more operations.
         """
 
+        # Mark the object as closed before freeing the handle, so that no
+        # other caller can pick it up in the meantime
+        handle = self.__handle
+        self.__handle = None
+
+        # Drop cached results, so that the accessors report the closed handle
+        # instead of answering from the cache
+        self.__generation += 1
+
         # If we are already closed, return
-        if not self.__handle or self.__handle == ffi.NULL:
+        if not handle or handle == ffi.NULL:
             return
 
         # Call the function
-        lib.aug_close(self.__handle)
+        lib.aug_close(handle)
+
+
+def _plan_file(filename, fspath, path, new):
+    # Compare the new contents of a file with the ones on disk
+    import difflib
+    try:
+        with open(fspath, "rb") as fp:
+            old = fp.read()
+        if PY3:
+            old = old.decode(AUGENC, "replace")
+    except IOError:
+        old = None
+    diff = "".join(difflib.unified_diff(
+        (old or "").splitlines(True), (new or "").splitlines(True),
+        "a" + filename if old is not None else "/dev/null",
+        "b" + filename if new is not None else "/dev/null"))
+    return FileChange(filename, path, old, new, diff)
+
+
+def _labelled(trees):
+    return all(node["label"] and _labelled(node["children"])
+               for node in trees)
+
+
+def _parallel_load_shard(args):
+    # Runs in a worker process of Augeas.parallel_load()
+    root, loadpath, flags, files = args
+    aug = Augeas(root=root, loadpath=loadpath,
+                 flags=flags | Augeas.NO_LOAD | Augeas.NO_MODL_AUTOLOAD)
+    try:
+        # One transform per lens, listing exactly the files of the shard
+        aug.remove("/augeas/load/*")
+        names = {}
+        for filename, lens in files:
+            name = names.setdefault(lens, "xfm%d" % len(names))
+            aug.set("/augeas/load/%s/lens" % name, lens)
+            aug.set("/augeas/load/%s/incl[last()+1]" % name,
+                    _glob_escape(filename))
+        aug.load()
+
+        result = {}
+        for filename, lens in files:
+            node = _files_path(filename)
+            trees = (aug.dump(node), aug.dump("/augeas" + node))
+            # Nodes without a label can not be recreated from their path
+            if _labelled(trees[0]):
+                result[filename] = trees
+        return result
+    finally:
+        aug.close()
+
+
+class ThreadSafeAugeas(Augeas):
+    """
+    An :class:`Augeas` object that can be shared between threads.
+
+    Every method holds :attr:`lock`, a reentrant lock owned by the handle,
+    for the whole call. Calls made from different threads therefore never
+    overlap on the handle, and :func:`~Augeas.close` waits for calls in
+    progress instead of freeing the handle under them. Hold :attr:`lock`
+    explicitly to make a sequence of calls, or the use of a
+    :class:`~augeas.query.Query`, atomic; an :class:`~augeas.index.Index`
+    holds it for every lookup.
+
+    The library is called with the GIL released, so threads working on
+    different handles run in parallel.
+    """
 
-        # Mark the object as closed
-        self.__handle = None
+    def __init__(self, *args, **kwargs):
+        #: the lock held by every method call
+        self.lock = threading.RLock()
+        super(ThreadSafeAugeas, self).__init__(*args, **kwargs)
+
+    def _locked(self):
+        return self.lock
+
+
+def _synchronized(name):
+    method = getattr(Augeas, name)
+
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+for _name, _value in list(vars(Augeas).items()):
+    if not _name.startswith('_') and \
+            isinstance(_value, types.FunctionType):
+        setattr(ThreadSafeAugeas, _name, _synchronized(_name))
+
+
+class MatchResult(_Sequence):
+    """
+    A read-only sequence of the paths returned by :func:`Augeas.lazy_match`.
+
+    The array of C strings returned by the library is kept as is and each
+    path is decoded when it is accessed. The array is freed when the object
+    is garbage collected.
+    """
+
+    def __init__(self, array, count):
+        self._count = count
+        self._array = ffi.gc(array, lambda array: _free_array(array, count))
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if index < 0 or index >= self._count:
+            raise IndexError("MatchResult index out of range")
+        item = self._array[index]
+        if item == ffi.NULL:
+            return None
+        return dec(ffi.string(item))
+
+    def __repr__(self):
+        return "MatchResult(%r)" % list(self)
+
+
+# These modules import the names defined above
+from augeas.index import Index  # noqa: E402
+from augeas.lenses import _LensIndex, _lens_name  # noqa: E402
+from augeas.query import Query  # noqa: E402
+from augeas.transaction import Transaction  # noqa: E402
+
+
+def diff(a, b, prefix="/files"):
+    """
+    Compute the changes that turn the tree of `a` under `prefix` into the
+    tree of `b` under `prefix`. `a` and `b` are :class:`Augeas` objects or
+    snapshots, i.e. the result of ``dump(prefix)`` on one; `prefix` must
+    match at most one node.
+
+    Identical subtrees are skipped as a whole by comparing hashes of their
+    contents. The children of nodes that differ are paired by label and
+    position, so a changed value becomes a single ``set``. The result is a
+    list of operations ``("set", path, value)``, ``("clear", path)`` for
+    nodes without a value, ``("insert", path, label, before)`` and
+    ``("remove", path)``, where every path is valid once the previous
+    operations have been made; they can be replayed on `a` with::
+
+        for op in diff(a, b, prefix):
+            getattr(a, op[0])(*op[1:])
+
+    :rtype: list(tuple)
+    """
+
+    if not isinstance(prefix, string_types):
+        raise TypeError("prefix MUST be a string!")
+    trees = []
+    for tree in (a, b):
+        if isinstance(tree, Augeas):
+            tree = tree.dump(prefix)
+        if len(tree) > 1:
+            raise ValueError("prefix MUST match at most one node!")
+        trees.append(tree)
+
+    from augeas.treediff import diff_trees
+    return diff_trees(trees[0], trees[1], prefix)
 
 
 # for backwards compatibility
@@ -864,4 +2823,5 @@ class augeas(Augeas):
         super(augeas, self).__init__(*p, **k)
 
 
-__all__ = ['Augeas', 'augeas']
+__all__ = ['Augeas', 'CacheInfo', 'FileChange', 'Index', 'ThreadSafeAugeas',
+           'Transaction', 'augeas', 'diff']
@@ -0,0 +1,135 @@
+"""
+An asyncio front-end for :class:`~augeas.Augeas`.
+
+Calls such as :func:`~augeas.Augeas.load`, :func:`~augeas.Augeas.save` or a
+large :func:`~augeas.Augeas.match` can block for a long time. The methods of
+:class:`AsyncAugeas` run them in an executor and can be awaited instead.
+
+This module requires Python 3.5 or later.
+"""
+
+import asyncio
+import functools
+import inspect
+
+from augeas import Augeas
+
+try:
+    _running_loop = asyncio.get_running_loop
+except AttributeError:
+    # Python < 3.7, where get_event_loop() returns the running loop when
+    # called from a coroutine
+    _running_loop = asyncio.get_event_loop
+
+# Methods whose results keep calling the handle after they have returned,
+# from whichever thread uses them; they are not wrapped
+_UNWRAPPED = frozenset(["prepare", "build_index", "transaction",
+                        "iter_match", "lazy_match"])
+
+
+class AsyncAugeas(object):
+    """
+    Wrapper around an :class:`~augeas.Augeas` handle whose methods are
+    coroutines. Every method of :class:`~augeas.Augeas` is available under
+    the same name and with the same arguments, except for
+    :func:`~augeas.Augeas.prepare`, :func:`~augeas.Augeas.build_index`,
+    :func:`~augeas.Augeas.transaction`, :func:`~augeas.Augeas.iter_match`
+    and :func:`~augeas.Augeas.lazy_match`: the objects they return call the
+    handle later on, outside of the executor. Use :func:`run` to work with
+    those objects, and :func:`match` instead of the last two.
+
+    Each call runs in `executor`, or in the default executor of the event
+    loop if `executor` is :py:obj:`None`. Calls are serialized per handle, so
+    concurrent coroutines never make overlapping calls on the same handle;
+    use one :class:`AsyncAugeas` per handle to run calls in parallel.
+
+    Only thread executors can be used: the handle lives in the memory of the
+    current process.
+
+    A call that is cancelled while waiting for its turn on the handle is
+    never made. A native call that has already been handed to the executor
+    can not be interrupted; it runs to completion, its result is discarded
+    and the handle stays busy until it returns.
+    """
+
+    def __init__(self, aug, executor=None):
+        if not isinstance(aug, Augeas):
+            raise TypeError("aug MUST be an Augeas object!")
+        self.aug = aug
+        self.executor = executor
+        self._lock = None
+
+    @classmethod
+    async def open(cls, root=None, loadpath=None, flags=Augeas.NONE,
+                   executor=None):
+        """
+        Create the :class:`~augeas.Augeas` handle in `executor` and return an
+        :class:`AsyncAugeas` wrapping it.
+        """
+        loop = _running_loop()
+        aug = await loop.run_in_executor(
+            executor, functools.partial(Augeas, root, loadpath, flags))
+        return cls(aug, executor)
+
+    @property
+    def generation(self):
+        return self.aug.generation
+
+    def _release(self, future):
+        self._lock.release()
+        # Retrieve the outcome of calls whose caller was cancelled
+        if not future.cancelled():
+            future.exception()
+
+    async def _call(self, func, *args, **kwargs):
+        loop = _running_loop()
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        await self._lock.acquire()
+        try:
+            future = loop.run_in_executor(
+                self.executor, functools.partial(func, *args, **kwargs))
+        except BaseException:
+            self._lock.release()
+            raise
+        # The lock is only released once the native call has returned,
+        # even if the awaiting coroutine is cancelled before that
+        future.add_done_callback(self._release)
+        return await asyncio.shield(future)
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Call ``func(aug, *args, **kwargs)`` in the executor with the
+        wrapped handle, in turn with the other calls, and return its
+        result. For example, to look up a value in an index::
+
+            await a.run(lambda aug: aug.build_index(prefix).lookup(value))
+        """
+        return await self._call(func, self.aug, *args, **kwargs)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+def _wrap(name):
+    method = getattr(Augeas, name)
+
+    async def wrapper(self, *args, **kwargs):
+        return await self._call(getattr(self.aug, name), *args, **kwargs)
+
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+for _name, _value in list(vars(Augeas).items()):
+    if not _name.startswith('_') and inspect.isfunction(_value) and \
+            _name not in _UNWRAPPED:
+        setattr(AsyncAugeas, _name, _wrap(_name))
+
+
+__all__ = ['AsyncAugeas']
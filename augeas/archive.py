@@ -0,0 +1,79 @@
+"""
+Parse the configuration files inside tar archives without extracting them.
+
+Auditing container images with :func:`~augeas.Augeas.load` means unpacking
+every layer to disk first. :func:`iter_archive` reads the members of a tar
+archive or an OCI image layer as a stream instead, picks the lens of each
+member from the transforms under :samp:`/augeas/load`, and parses it in
+memory with :func:`~augeas.Augeas.parse`::
+
+    aug = Augeas(flags=Augeas.NO_LOAD)
+    with open("layer.tar.gz", "rb") as layer:
+        for entry in iter_archive(aug, layer):
+            if entry.error is None:
+                print(entry.filename, entry.tree)
+"""
+
+import collections
+import posixpath
+import tarfile
+
+#: A file parsed by :func:`iter_archive`. `tree` is in the format returned
+#: by :func:`~augeas.Augeas.dump`, or :py:obj:`None` if parsing failed, in
+#: which case `error` holds the :class:`~augeas.AugeasValueError`.
+ArchiveFile = collections.namedtuple("ArchiveFile",
+                                     "filename lens tree error")
+
+# Prefix of the whiteout files that delete a path in OCI and Docker layers
+_WHITEOUT = ".wh."
+
+
+def iter_archive(aug, fileobj, max_size=None):
+    """
+    Parse the regular files of the tar archive read from `fileobj` that a
+    transform of `aug` applies to, and yield an :class:`ArchiveFile` for
+    each, in the order of the archive.
+
+    The archive is read sequentially, so `fileobj` can be a pipe or a
+    network stream; it can be compressed with any compression
+    :mod:`tarfile` supports. Member names are taken as relative to the
+    root, so :samp:`etc/hosts` and :samp:`./etc/hosts` are both parsed as
+    :samp:`/etc/hosts` with the lens :func:`~augeas.Augeas.lens_for`
+    returns. Directories, links, devices and whiteout files are skipped, as
+    are members for which no transform is found.
+
+    The tree of `aug` is left as it was; create it with
+    :attr:`~augeas.Augeas.NO_LOAD` so that files are not loaded from disk
+    for nothing.
+
+    :param aug: the handle whose transforms and lenses are used
+    :type aug: :class:`~augeas.Augeas`
+    :param fileobj: a binary file object to read the archive from
+    :param max_size: skip members larger than this many bytes
+    :type max_size: int or None
+    :rtype: iterator(:class:`ArchiveFile`)
+    """
+
+    with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            if max_size is not None and member.size > max_size:
+                continue
+            filename = posixpath.normpath("/" + member.name.lstrip("/"))
+            if posixpath.basename(filename).startswith(_WHITEOUT):
+                continue
+            lens = aug.lens_for(filename)
+            if lens is None:
+                continue
+
+            data = tar.extractfile(member).read()
+            try:
+                tree = aug.parse(lens, data)
+            except ValueError as e:
+                yield ArchiveFile(filename, lens, None, e)
+                continue
+            yield ArchiveFile(filename, lens, tree, None)
+
+
+__all__ = ['ArchiveFile', 'iter_archive']
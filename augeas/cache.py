@@ -0,0 +1,165 @@
+"""
+A persistent cache of parsed files.
+
+Parsing a file with its lens is the bulk of the work done by
+:func:`~augeas.Augeas.load`. :class:`ParseCache` stores the tree of every file
+it loads in a directory, keyed by the lens, the contents of the file and the
+version of the library. When a process loads an unchanged file again, its
+tree is rebuilt from the cache instead of being parsed.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+from augeas import _files_path
+
+
+class ParseCache(object):
+    """
+    A cache of parsed files stored in `directory`, which is created if needed
+    and can be shared between processes.
+
+    Use it on a handle created with :attr:`~augeas.Augeas.NO_LOAD`, in place
+    of :func:`~augeas.Augeas.load` and :func:`~augeas.Augeas.load_file`::
+
+        aug = Augeas(flags=Augeas.NO_LOAD)
+        ParseCache("/var/cache/myapp/augeas").load(aug)
+
+    There are a few differences with a tree loaded by the library:
+
+    * The key contains the name of the lens, not its source. Call
+      :func:`clear` after changing the lenses in the load path.
+    * Files that fail to parse are never cached; they are parsed every time
+      and their errors are recorded under :samp:`/augeas/files` as usual.
+    * The library considers rebuilt trees as modified, so
+      :func:`~augeas.Augeas.save` writes them back, with their unchanged
+      contents, and a :func:`~augeas.Augeas.load` parses them again.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _key(self, aug, lens, data):
+        digest = hashlib.sha256()
+        for part in (lens, aug.get("/augeas/version")):
+            digest.update((part or "").encode("utf8") + b"\0")
+        digest.update(hashlib.sha256(data).digest())
+        return digest.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _read(self, key):
+        try:
+            with open(self._entry(key)) as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write(self, key, entry):
+        path = self._entry(key)
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                if not os.path.isdir(os.path.dirname(path)):
+                    raise
+        # Write to a temporary file first, so that concurrent readers never
+        # see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "w") as fp:
+                json.dump(entry, fp)
+            os.rename(tmp, path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+    def load(self, aug):
+        """
+        Load every file that the transforms of `aug` apply to, like
+        :func:`~augeas.Augeas.load` does, using the cache for the files it
+        contains.
+        """
+
+        for filename, lens in aug._transform_files():
+            self.load_file(aug, filename, lens)
+
+    def load_file(self, aug, filename, lens=None):
+        """
+        Load `filename` into `aug` like :func:`~augeas.Augeas.load_file`
+        does, rebuilding its tree from the cache if the file is in it and
+        storing it otherwise.
+
+        :param lens: the name of the lens that applies to `filename`, looked
+                     up in the transforms of `aug` if :py:obj:`None`
+        """
+
+        if lens is None:
+            lens = aug.lens_for(filename)
+        if lens is None:
+            # Let the library report that no lens applies
+            aug.load_file(filename)
+            return
+
+        fspath = aug.get("/augeas/root").rstrip("/") + filename
+        with open(fspath, "rb") as fp:
+            data = fp.read()
+        key = self._key(aug, lens, data)
+        node = _files_path(filename)
+        info = "/augeas" + node
+
+        entry = self._read(key)
+        if entry is not None:
+            self.hits += 1
+            aug.remove(node)
+            aug.remove(info)
+            value = entry["tree"]["value"]
+            if value is None:
+                aug.clear(node)
+            else:
+                aug.set(node, value)
+            aug._load_tree(node, entry["tree"]["children"])
+            aug.set(info + "/path", "/files" + filename)
+            aug.set(info + "/mtime", str(int(os.stat(fspath).st_mtime)))
+            aug.set(info + "/lens", entry["lens"])
+            return
+
+        self.misses += 1
+        aug.load_file(filename)
+        if aug.match(info + "/error"):
+            return
+        # Only store the tree if the file did not change while it was parsed
+        with open(fspath, "rb") as fp:
+            if fp.read() != data:
+                return
+        trees = aug.dump(node)
+        if len(trees) != 1:
+            return
+        self._write(key, {"lens": aug.get(info + "/lens"), "tree": trees[0]})
+
+    def clear(self):
+        "Remove every entry from the cache"
+
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for name in filenames:
+                if name.endswith(".json"):
+                    os.unlink(os.path.join(dirpath, name))
+
+    def stats(self):
+        """
+        Return the number of ``hits`` and ``misses`` of the cache as a dict.
+
+        :rtype: dict
+        """
+
+        return {"hits": self.hits, "misses": self.misses}
+
+
+__all__ = ['ParseCache']
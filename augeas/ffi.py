@@ -19,13 +19,19 @@ def get_include_dirs():
 ffi = FFI()
 ffi.set_source("_augeas",
                """
+               #include <stdio.h>
                #include <augeas.h>
+               #include <libxml/tree.h>
                """,
-               libraries=['augeas'],
+               libraries=['augeas', 'xml2'],
                include_dirs=get_include_dirs())
 
 ffi.cdef("""
 typedef struct augeas augeas;
+typedef unsigned char xmlChar;
+typedef struct _xmlNode xmlNode;
+typedef struct _xmlDoc xmlDoc;
+typedef struct _xmlBuffer xmlBuffer;
 
 augeas *aug_init(const char *root, const char *loadpath, unsigned int flags);
 int aug_defvar(augeas *aug, const char *name, const char *expr);
@@ -66,6 +72,10 @@ int aug_ns_value(const augeas *aug, const char *var, int i,
                  const char **value);
 int aug_ns_count(const augeas *aug, const char *var);
 int aug_ns_path(const augeas *aug, const char *var, int i, char **path);
+int aug_to_xml(const augeas *aug, const char *path, xmlNode **xmldoc,
+               unsigned int flags);
+int aug_print(const augeas *aug, FILE *out, const char *path);
+int aug_escape_name(augeas *aug, const char *in, char **out);
 
 
 
@@ -76,6 +86,16 @@ const char *aug_error_minor_message(augeas *aug);
 const char *aug_error_details(augeas *aug);
 
 void free(void *);
+FILE *open_memstream(char **ptr, size_t *sizeloc);
+int fclose(FILE *stream);
+
+xmlBuffer *xmlBufferCreate(void);
+void xmlBufferFree(xmlBuffer *buf);
+const xmlChar *xmlBufferContent(const xmlBuffer *buf);
+int xmlBufferLength(const xmlBuffer *buf);
+int xmlNodeDump(xmlBuffer *buf, xmlDoc *doc, xmlNode *cur, int level,
+                int format);
+void xmlFreeNode(xmlNode *cur);
 """)
 
 if __name__ == "__main__":
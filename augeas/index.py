@@ -0,0 +1,162 @@
+"""
+Indexes of the values and labels of the nodes in a subtree.
+
+:func:`~augeas.Augeas.match` evaluates a path expression over the tree on
+every call. An :class:`Index` reads a subtree once and answers lookups by
+value or label from dictionaries, keeping itself up to date as the tree is
+changed through the same handle.
+"""
+
+from augeas import _family, _parent_path
+
+
+class Index(object):
+    """
+    An index of the values and labels of the nodes in a subtree, created by
+    :func:`~augeas.Augeas.build_index`.
+
+    Lookups are dictionary lookups. The index follows the changes made
+    through :func:`~augeas.Augeas.set`, :func:`~augeas.Augeas.remove` and
+    :func:`~augeas.Augeas.move` by reading the touched nodes and their siblings
+    with the same label again, whose paths may have changed; after any
+    other change to the tree, the next lookup rebuilds the whole index.
+    Nodes created outside the indexed subtrees that match `prefix` are only
+    seen after a rebuild.
+    """
+
+    def __init__(self, aug, prefix, labels=None):
+        self.aug = aug
+        self.prefix = prefix
+        self.labels = frozenset(labels) if labels is not None else None
+        #: the number of times the whole index was built
+        self.rebuilds = 0
+        self._generation = None
+        self._roots = []
+        # path -> (label, value) of every node in the indexed subtrees
+        self._nodes = {}
+        # path -> set of the paths of its children
+        self._children = {}
+        # value or label -> set of paths, for the indexed labels only
+        self._values = {}
+        self._labelled = {}
+
+    def _add(self, path, label, value):
+        self._nodes[path] = (label, value)
+        self._children.setdefault(_parent_path(path), set()).add(path)
+        if self.labels is not None and label not in self.labels:
+            return
+        self._labelled.setdefault(label, set()).add(path)
+        if value is not None:
+            self._values.setdefault(value, set()).add(path)
+
+    def _discard(self, mapping, key, path):
+        paths = mapping.get(key)
+        if paths is not None:
+            paths.discard(path)
+            if not paths:
+                del mapping[key]
+
+    def _drop(self, path):
+        for child in list(self._children.pop(path, ())):
+            self._drop(child)
+        label, value = self._nodes.pop(path)
+        self._discard(self._children, _parent_path(path), path)
+        self._discard(self._labelled, label, path)
+        self._discard(self._values, value, path)
+
+    def _scan(self, expr):
+        aug = self.aug
+        errmsg = "Augeas.build_index() failed"
+        try:
+            aug._define_nodeset("_pyaug_index_top", expr, errmsg)
+            aug._define_nodeset("_pyaug_index",
+                                "$_pyaug_index_top/descendant-or-self::*",
+                                errmsg)
+            for node in aug._ns_nodes("_pyaug_index", errmsg):
+                self._add(*node)
+        finally:
+            aug._undefine("_pyaug_index_top")
+            aug._undefine("_pyaug_index")
+
+    def _rescan(self, path):
+        # Read the node at `path` and its siblings with the same label again
+        parent, family = _family(path)
+        for child in list(self._children.get(parent, ())):
+            if _family(child)[1] == family:
+                self._drop(child)
+        self._scan(parent + "/" + family)
+
+    def _update(self, paths):
+        # Called by the Augeas object right after a call that changed the
+        # generation once and touched the nodes at `paths`, with the lock of
+        # the handle held
+        aug = self.aug
+        if self._generation != aug.generation - 1:
+            return
+        if paths is None:
+            self._generation = None
+            return
+        for path in paths:
+            if not any(path.startswith(root + "/") for root in self._roots):
+                if any(path == root or root.startswith(path + "/")
+                       for root in self._roots):
+                    # An indexed subtree itself changed
+                    self._generation = None
+                    return
+                continue
+            # Start from the topmost node the call may have created
+            while _parent_path(path) not in self._nodes:
+                path = _parent_path(path)
+            self._rescan(path)
+        self._generation = aug.generation
+
+    def rebuild(self):
+        "Build the whole index again"
+        with self.aug._locked():
+            self._nodes.clear()
+            self._children.clear()
+            self._values.clear()
+            self._labelled.clear()
+            self._roots = self.aug.match(self.prefix)
+            self._scan(self.prefix)
+            self._generation = self.aug.generation
+            self.rebuilds += 1
+
+    def _sync(self):
+        # Callers hold the lock of the handle, so that a rebuild and the
+        # reads that follow it are not interleaved with other threads
+        if self._generation != self.aug.generation:
+            self.rebuild()
+
+    def lookup(self, value):
+        """
+        Return the paths of the indexed nodes whose value is `value`.
+
+        :rtype: list(str)
+        """
+        with self.aug._locked():
+            self._sync()
+            return sorted(self._values.get(value, ()))
+
+    def labelled(self, label):
+        """
+        Return the paths of the indexed nodes labelled `label`.
+
+        :rtype: list(str)
+        """
+        with self.aug._locked():
+            self._sync()
+            return sorted(self._labelled.get(label, ()))
+
+    def __contains__(self, value):
+        with self.aug._locked():
+            self._sync()
+            return value in self._values
+
+    def __len__(self):
+        with self.aug._locked():
+            self._sync()
+            return sum(len(paths) for paths in self._labelled.values())
+
+
+__all__ = ['Index']
@@ -0,0 +1,104 @@
+"""
+The lookup of the lens that the transforms apply to a file.
+"""
+
+import re
+
+from augeas import _glob_regex
+
+
+def _glob_dir(pattern):
+    """
+    Return the literal directory part of the glob `pattern`, up to and
+    including the last :samp:`/` before the first wildcard. Every path the
+    pattern matches lies under that directory.
+    """
+    m = re.search(r'[*?[\\]', pattern)
+    literal = pattern[:m.start()] if m else pattern
+    if '/' not in pattern:
+        return ''
+    return literal[:literal.rfind('/') + 1]
+
+
+def _lens_name(lens):
+    """
+    Return the name of `lens`, as found under :samp:`/augeas/load`, in the
+    form accepted by :func:`~augeas.Augeas.parse`: autoloaded transforms
+    refer to the lens ``lns`` of a module as ``@Module``.
+    """
+    if lens.startswith('@'):
+        return lens[1:] + '.lns'
+    return lens
+
+
+class _LensIndex(object):
+    """
+    Map filenames to the lens of the first transform that includes them
+    and does not exclude them, as :func:`~augeas.Augeas.load` does. Lenses
+    are returned as the transforms name them.
+
+    The `incl` globs are grouped by their literal directory, and the globs
+    of each group are compiled into one regular expression whose
+    alternatives are in the order of the transforms. A lookup only tries
+    the groups of the directories above the file, with one match each.
+    """
+
+    # Python 2 does not support more than 100 groups in a pattern
+    _CHUNK = 90
+
+    def __init__(self, transforms):
+        self._lenses = []
+        self._excl = []
+        groups = {}
+        for number, (lens, incl, excl) in enumerate(transforms):
+            self._lenses.append(lens or None)
+            self._excl.append([_glob_regex(pattern) for pattern in excl])
+            if not lens:
+                continue
+            for pattern in incl:
+                groups.setdefault(_glob_dir(pattern), []).append(
+                    (number, _glob_regex(pattern)))
+
+        # directory -> list of (combined regex, [(number, regex)])
+        self._groups = {}
+        for directory, members in groups.items():
+            members.sort(key=lambda member: member[0])
+            chunks = []
+            for i in range(0, len(members), self._CHUNK):
+                chunk = members[i:i + self._CHUNK]
+                combined = re.compile('|'.join(
+                    '(%s)' % regex.pattern for number, regex in chunk))
+                chunks.append((combined, chunk))
+            self._groups[directory] = chunks
+
+    def _excluded(self, number, filename):
+        return any(regex.match(filename) for regex in self._excl[number])
+
+    def _first(self, chunk, filename, start):
+        for number, regex in chunk[start:]:
+            if regex.match(filename) and not self._excluded(number, filename):
+                return number
+        return None
+
+    def lookup(self, filename):
+        best = None
+        directories = ['']
+        end = filename.find('/')
+        while end >= 0:
+            directories.append(filename[:end + 1])
+            end = filename.find('/', end + 1)
+
+        for directory in directories:
+            for combined, chunk in self._groups.get(directory, ()):
+                m = combined.match(filename)
+                if m is None:
+                    continue
+                # The first alternative that matches is the one of the
+                # earliest transform
+                position = m.lastindex - 1
+                number = chunk[position][0]
+                if self._excluded(number, filename):
+                    number = self._first(chunk, filename, position + 1)
+                if number is not None and (best is None or number < best):
+                    best = number
+        return self._lenses[best] if best is not None else None
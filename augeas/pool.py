@@ -0,0 +1,246 @@
+"""
+A pool of initialized Augeas handles that can be shared between threads.
+
+Creating an :class:`~augeas.Augeas` object autoloads and compiles every lens
+module and parses the whole tree, which is expensive. A handle can however
+only be used by one thread at a time. :class:`AugeasPool` keeps a number of
+initialized handles around and hands each of them out to one user at a time.
+"""
+
+import contextlib
+import threading
+import time
+
+from augeas import Augeas
+
+
+class AugeasPool(object):
+    """
+    A thread-safe pool of :class:`~augeas.Augeas` handles.
+
+    Handles are kept separately for every combination of `root`, `loadpath`
+    and `flags` they were created with; at most `size` handles exist for each
+    combination. A handle that stays idle in the pool for more than
+    `idle_timeout` seconds is closed.
+    """
+
+    def __init__(self, size=4, idle_timeout=300.0, factory=Augeas):
+        """
+        :param size: the maximum number of handles per combination of `root`,
+                     `loadpath` and `flags`
+        :type size: int
+        :param idle_timeout: the number of seconds after which an idle handle
+                             is closed, or :py:obj:`None` to keep idle handles
+                             forever
+        :type idle_timeout: float or None
+        :param factory: the callable used to create new handles; it is passed
+                        `root`, `loadpath` and `flags` as keyword arguments
+        """
+
+        if not isinstance(size, int) or size < 1:
+            raise ValueError("size MUST be a positive integer!")
+
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.factory = factory
+
+        self._cond = threading.Condition()
+        # key -> list of (handle, time it was returned), most recent last
+        self._idle = {}
+        # handle -> (key, generation when it was checked out)
+        self._busy = {}
+        # key -> number of handles in existence
+        self._count = {}
+        self._closed = False
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.evictions = 0
+
+    def _discard(self, key, aug):
+        # Must be called with self._cond held
+        aug.close()
+        self._count[key] -= 1
+        self._cond.notify_all()
+
+    def _evict_idle(self):
+        # Must be called with self._cond held
+        if self.idle_timeout is None:
+            return
+        deadline = time.time() - self.idle_timeout
+        for key, idle in self._idle.items():
+            while idle and idle[0][1] <= deadline:
+                aug, _ = idle.pop(0)
+                self._discard(key, aug)
+                self.evictions += 1
+
+    def _reset(self, aug, flags):
+        # Throw away changes made to the tree while the handle was checked out
+        if flags & Augeas.NO_LOAD:
+            aug.remove("/files/*")
+            aug.remove("/augeas/files/*")
+        else:
+            aug.load()
+
+    def checkout(self, root=None, loadpath=None, flags=Augeas.NONE,
+                 timeout=None):
+        """
+        Take a handle created with `root`, `loadpath` and `flags` out of the
+        pool, creating a new one if none is idle and fewer than :attr:`size`
+        exist. Otherwise, wait until another user returns one, for at most
+        `timeout` seconds if `timeout` is not :py:obj:`None`.
+
+        The handle must be given back with :func:`checkin`.
+
+        :rtype: :class:`~augeas.Augeas`
+        """
+
+        key = (root, loadpath, flags)
+        aug = None
+        started = None
+
+        with self._cond:
+            self._evict_idle()
+            while True:
+                if self._closed:
+                    raise RuntimeError("The pool has already been closed!")
+                idle = self._idle.get(key)
+                if idle:
+                    aug, _ = idle.pop()
+                    self.hits += 1
+                    break
+                if self._count.get(key, 0) < self.size:
+                    self._count[key] = self._count.get(key, 0) + 1
+                    self.misses += 1
+                    break
+
+                if started is None:
+                    started = time.time()
+                    self.waits += 1
+                remaining = None
+                if timeout is not None:
+                    remaining = timeout - (time.time() - started)
+                    if remaining <= 0:
+                        self.wait_time += time.time() - started
+                        raise RuntimeError("Timed out waiting for an Augeas "
+                                           "handle!")
+                self._cond.wait(remaining)
+
+            if started is not None:
+                self.wait_time += time.time() - started
+
+        if aug is None:
+            try:
+                aug = self.factory(root=root, loadpath=loadpath, flags=flags)
+            except Exception:
+                with self._cond:
+                    self._count[key] -= 1
+                    self._cond.notify_all()
+                raise
+
+        with self._cond:
+            self._busy[aug] = (key, aug.generation)
+        return aug
+
+    def checkin(self, aug):
+        """
+        Give a handle obtained from :func:`checkout` back to the pool.
+
+        If the tree has been modified while the handle was checked out, the
+        files in it are loaded again, so that the next user finds it in its
+        initial state. Variables and changes to :samp:`/augeas/load` are not
+        reverted. A handle that can not be reset is closed instead.
+        """
+
+        with self._cond:
+            try:
+                key, generation = self._busy.pop(aug)
+            except KeyError:
+                raise ValueError("The handle was not checked out from this "
+                                 "pool!")
+
+        try:
+            if aug.generation != generation:
+                self._reset(aug, key[2])
+        except Exception:
+            with self._cond:
+                self._discard(key, aug)
+            raise
+
+        with self._cond:
+            if self._closed:
+                self._discard(key, aug)
+                return
+            self._idle.setdefault(key, []).append((aug, time.time()))
+            self._evict_idle()
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def handle(self, root=None, loadpath=None, flags=Augeas.NONE,
+               timeout=None):
+        """
+        Context manager that checks out a handle with :func:`checkout` and
+        gives it back with :func:`checkin` when the block is left.
+        """
+
+        aug = self.checkout(root, loadpath, flags, timeout)
+        try:
+            yield aug
+        finally:
+            self.checkin(aug)
+
+    def evict(self):
+        """
+        Close the handles that have been idle for longer than
+        :attr:`idle_timeout`.
+        """
+
+        with self._cond:
+            self._evict_idle()
+
+    def stats(self):
+        """
+        Return usage statistics of the pool as a dict with the keys
+        ``hits`` (checkouts served by an idle handle), ``misses`` (checkouts
+        that created a handle), ``waits`` (checkouts that had to wait for a
+        handle to be returned), ``wait_time`` (the total number of seconds
+        spent waiting), ``evictions``, ``idle`` and ``busy``.
+
+        :rtype: dict
+        """
+
+        with self._cond:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "wait_time": self.wait_time,
+                "evictions": self.evictions,
+                "idle": sum(len(idle) for idle in self._idle.values()),
+                "busy": len(self._busy),
+            }
+
+    def close(self):
+        """
+        Close all idle handles. Handles that are checked out are closed when
+        they are given back.
+        """
+
+        with self._cond:
+            self._closed = True
+            for key, idle in self._idle.items():
+                while idle:
+                    aug, _ = idle.pop()
+                    self._discard(key, aug)
+            self._cond.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+__all__ = ['AugeasPool']
@@ -0,0 +1,119 @@
+"""
+Path expressions evaluated once and read many times.
+"""
+
+import itertools
+
+
+class Query(object):
+    """
+    A path expression registered through :func:`~augeas.Augeas.prepare`.
+
+    The nodes matching the expression are kept in an Augeas variable, and its
+    results are read with the :func:`~augeas.Augeas.ns_count` family of
+    functions instead of evaluating the expression again. The variable is
+    refreshed automatically when :attr:`~augeas.Augeas.generation` shows that
+    the tree has been modified since it was last evaluated.
+
+    The variable is removed by :func:`close`. If the query is garbage
+    collected without being closed, the variable is reused by the next
+    :func:`~augeas.Augeas.prepare` on the same handle.
+    """
+
+    _ids = itertools.count()
+
+    def __init__(self, aug, expr, name=None):
+        self.aug = aug
+        self.expr = expr
+        #: the name of the Augeas variable holding the nodeset
+        self.name = name or "_pyaug_query%d" % next(Query._ids)
+        self._generation = None
+
+    def refresh(self, force=False):
+        """
+        Evaluate the expression again if the tree has changed since it was
+        last evaluated, or unconditionally if `force` is :py:obj:`True`.
+        """
+        aug = self.aug
+        with aug._locked():
+            if force or self._generation != aug.generation:
+                aug._define_nodeset(self.name, self.expr,
+                                    "Augeas.prepare() failed")
+                self._generation = aug.generation
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self.paths())
+
+    def count(self):
+        """
+        Return the number of nodes matching the expression.
+        """
+        self.refresh()
+        return self.aug.ns_count(self.name)
+
+    def paths(self):
+        """
+        Return the paths of the matching nodes, like
+        :func:`~augeas.Augeas.match`.
+        """
+        self.refresh()
+        aug = self.aug
+        return [aug.ns_path(self.name, i)
+                for i in range(aug.ns_count(self.name))]
+
+    def labels(self):
+        """
+        Return the labels of the matching nodes.
+        """
+        self.refresh()
+        aug = self.aug
+        return [aug.ns_label(self.name, i)[0]
+                for i in range(aug.ns_count(self.name))]
+
+    def values(self):
+        """
+        Return the values of the matching nodes.
+        """
+        self.refresh()
+        aug = self.aug
+        return [aug.ns_value(self.name, i)
+                for i in range(aug.ns_count(self.name))]
+
+    def get(self):
+        """
+        Return the value of the single matching node, or :py:obj:`None` if no
+        node matches, like :func:`~augeas.Augeas.get`.
+        """
+        self.refresh()
+        count = self.aug.ns_count(self.name)
+        if count > 1:
+            raise ValueError("Query.get() failed: %s matches %d nodes"
+                             % (self.expr, count))
+        if count == 0:
+            return None
+        return self.aug.ns_value(self.name, 0)
+
+    def close(self):
+        """
+        Remove the variable backing this query.
+        """
+        with self.aug._locked():
+            if self._generation is not None:
+                self.aug._undefine(self.name)
+                self._generation = None
+
+    def __del__(self):
+        if self._generation is not None:
+            self.aug._release_query(self.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+__all__ = ['Query']
@@ -0,0 +1,235 @@
+"""
+All-or-nothing batches of changes to the tree.
+"""
+
+import itertools
+
+from augeas import (Augeas, AugeasIOError, AugeasRuntimeError,
+                    AugeasValueError, string_types, _file_prefixes,
+                    _files_path, _parent_path, _split_expr)
+
+
+# The changes that can be queued in a Transaction, with the positions of
+# their arguments that name the nodes they modify
+_TRANSACTION_OPERATIONS = {
+    "set": (0,),
+    "setm": (0,),
+    "insert": (0,),
+    "remove": (0,),
+    "move": (0, 1),
+    "copy": (1,),
+    "rename": (0,),
+}
+
+
+class Transaction(object):
+    """
+    A batch of changes created by :func:`~augeas.Augeas.transaction`.
+
+    The methods :func:`set`, :func:`setm`, :func:`insert`, :func:`remove`,
+    :func:`move`, :func:`copy` and :func:`rename` take the same arguments as
+    the methods of :class:`~augeas.Augeas` but only queue the change. When the
+    ``with`` block is left without an exception, or :func:`commit` is
+    called:
+
+    #. the subtree of every file the queued changes can touch is copied to
+       a scratch area under :samp:`/augeas/python`, with one
+       :func:`~augeas.Augeas.copy` per file;
+    #. the changes are applied in order;
+    #. the tree is saved with :samp:`/augeas/save` set to ``noop``, which
+       checks that every modified file can be written without writing it;
+    #. the tree is saved for real, unless the transaction was created with
+       ``save=False``.
+
+    Only the files the changes can touch are checked: a file that was
+    already modified and can not be saved does not make the transaction
+    fail.
+
+    If any step fails, the files are restored from their copies and the
+    exception is raised again. A restored file whose contents on disk still
+    match its copy is loaded again instead, so that the next
+    :func:`~augeas.Augeas.save` does not write it. A failure while saving
+    for real can leave some files written on disk. Changes to nodes outside
+    :samp:`/files` are not restored.
+
+    If the ``with`` block raises an exception, the queued changes are
+    discarded without touching the tree.
+
+    Every change is still one call into the library, and the copies and the
+    validating save come on top of that. What a transaction saves is the
+    upkeep of the indexes built with :func:`~augeas.Augeas.build_index`:
+    instead of reading the touched nodes again after every change, they are
+    rebuilt once, when they are next used. On a
+    :class:`~augeas.ThreadSafeAugeas`, :func:`commit` holds the lock of the
+    handle throughout.
+    """
+
+    _ids = itertools.count()
+
+    def __init__(self, aug, save=True):
+        self.aug = aug
+        self.save = save
+        #: the queued changes, as ``(method name, args, kwargs)``
+        self.operations = []
+        self._scratch = "/augeas/python/transaction%d" % next(Transaction._ids)
+
+    def __len__(self):
+        return len(self.operations)
+
+    def _prefixes(self, operations):
+        # The paths relative to the root that `operations` can touch
+        prefixes = set()
+        for name, args, kwargs in operations:
+            for position in _TRANSACTION_OPERATIONS[name]:
+                expr = args[position] if position < len(args) else None
+                if not isinstance(expr, string_types):
+                    # The call itself will fail
+                    continue
+                prefixes.update(_file_prefixes(expr))
+                # Variables and relative paths can refer to any node
+                if any(not alt.strip().startswith('/')
+                       for alt in _split_expr(expr, '|')):
+                    prefixes.add('/')
+        return prefixes
+
+    def _roots(self, operations):
+        # The subtrees to checkpoint, with the name of their file: tracked
+        # files and, for new nodes, the topmost node the changes would create
+        aug = self.aug
+        tracked = sorted(aug._tracked_files())
+        roots = {}
+        for prefix in self._prefixes(operations):
+            files = [f for f in tracked
+                     if prefix == f or prefix.startswith(f + "/") or
+                     f.startswith(prefix.rstrip("/") + "/")]
+            if files:
+                roots.update((_files_path(f), f) for f in files)
+                continue
+            if prefix == "/":
+                continue
+            node = _files_path(prefix)
+            while _parent_path(node) != "/files" and \
+                    not aug.match(_parent_path(node)):
+                node = _parent_path(node)
+            roots.setdefault(node, None)
+        # Drop the roots that lie inside another one
+        result = []
+        for root in sorted(roots):
+            if not result or not root.startswith(result[-1][0] + "/"):
+                result.append((root, roots[root]))
+        return result
+
+    def _checkpoint(self, roots):
+        # Copy every root that exists; copying one that does not fails
+        aug = self.aug
+        saved = []
+        for i, (root, filename) in enumerate(roots):
+            copy = "%s/%d" % (self._scratch, i)
+            try:
+                aug.copy(root, copy)
+            except AugeasValueError:
+                copy = None
+            saved.append((root, filename, copy))
+        return saved
+
+    def _reload(self, root, filename, copy):
+        # Load the file again if that gives back the tree in `copy`, which
+        # leaves it unmodified as far as save() is concerned
+        aug = self.aug
+        try:
+            aug.load_file(filename)
+        except AugeasRuntimeError:
+            return False
+        loaded = [(t["value"], t["children"]) for t in aug.dump(root)]
+        return loaded == [(t["value"], t["children"]) for t in aug.dump(copy)]
+
+    def _restore(self, saved):
+        aug = self.aug
+        for root, filename, copy in saved:
+            if copy is not None and filename is not None and \
+                    self._reload(root, filename, copy):
+                continue
+            aug.remove(root)
+            if copy is not None:
+                aug.move(copy, root)
+        aug.remove(self._scratch)
+
+    def _rollback(self, saved):
+        # A failing restore must not hide the exception that caused it,
+        # which the caller raises again once this returns
+        try:
+            self._restore(saved)
+        except Exception:
+            pass
+
+    def _save(self, roots, dry):
+        # Save the tree, or only check that it can be saved if `dry`;
+        # failures to save files outside `roots` are ignored
+        aug = self.aug
+        if dry:
+            error = aug._dry_save()
+            if error is None:
+                return
+        else:
+            try:
+                aug.save()
+                return
+            except AugeasIOError as e:
+                error = e
+        failed = [_parent_path(path)[len("/augeas"):]
+                  for path in aug.match("/augeas/files//error[../path]")]
+        if not failed or any(node == root or root.startswith(node + "/") or
+                             node.startswith(root + "/")
+                             for node in failed for root, filename in roots):
+            raise error
+
+    def commit(self):
+        """
+        Apply the queued changes, validate and save them as described above.
+        The queue is emptied whether the transaction succeeds or not.
+        """
+
+        aug = self.aug
+        operations, self.operations = self.operations, []
+        if not operations:
+            return
+
+        with aug._locked():
+            roots = self._roots(operations)
+            saved = self._checkpoint(roots)
+            try:
+                aug._apply(operations)
+                self._save(roots, True)
+                if self.save:
+                    self._save(roots, False)
+            except BaseException:
+                self._rollback(saved)
+                raise
+            aug.remove(self._scratch)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.operations = []
+
+
+def _queued(name):
+    method = getattr(Augeas, name)
+
+    def wrapper(self, *args, **kwargs):
+        self.operations.append((name, args, kwargs))
+
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+for _name in _TRANSACTION_OPERATIONS:
+    setattr(Transaction, _name, _queued(_name))
+
+
+__all__ = ['Transaction']
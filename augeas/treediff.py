@@ -0,0 +1,153 @@
+"""
+The computation of the changes between two trees, behind
+:func:`augeas.diff`.
+"""
+
+import difflib
+
+from augeas import _escape_label
+
+
+def _tree_hashes(trees, hashes):
+    # Store the hash of every subtree in `hashes`, keyed by the id of its
+    # dict, and return the hashes of `trees`
+    result = []
+    for node in trees:
+        digest = hash((node["label"], node["value"],
+                       tuple(_tree_hashes(node["children"], hashes))))
+        hashes[id(node)] = digest
+        result.append(digest)
+    return result
+
+
+class _Siblings(object):
+    """
+    The labels of the children of the node at `path` as they are after the
+    operations emitted so far. Children before :attr:`pos` have been
+    handled; :attr:`counts` counts their labels.
+    """
+
+    def __init__(self, path, labels):
+        self.path = path
+        self.labels = labels
+        self.pos = 0
+        self.counts = {}
+
+    def path_at(self, pos):
+        # Only valid for the children at pos - 1 and pos
+        label = self.labels[pos]
+        count = self.counts.get(label, 0)
+        if pos == self.pos:
+            count += 1
+        return "%s/%s[%d]" % (self.path, _escape_label(label), count)
+
+    def advance(self):
+        # Move past the child at pos and return its path
+        label = self.labels[self.pos]
+        self.counts[label] = self.counts.get(label, 0) + 1
+        self.pos += 1
+        return self.path_at(self.pos - 1)
+
+
+class _Differ(object):
+    "Compute the operations returned by :func:`diff_trees`"
+
+    def __init__(self, hashes):
+        self.hashes = hashes
+        self.ops = []
+
+    def assign(self, path, value):
+        # set() stores None as an empty value; only clear() leaves a node
+        # without one
+        if value is None:
+            self.ops.append(("clear", path))
+        else:
+            self.ops.append(("set", path, value))
+
+    def create(self, path, node):
+        # Create the descendants of `node`, which has no children yet
+        counts = {}
+        for child in node["children"]:
+            label = child["label"]
+            counts[label] = counts.get(label, 0) + 1
+            cpath = "%s/%s[%d]" % (path, _escape_label(label), counts[label])
+            self.assign(cpath, child["value"])
+            self.create(cpath, child)
+
+    def compare(self, path, a, b):
+        if self.hashes[id(a)] == self.hashes[id(b)]:
+            return
+        if a["value"] != b["value"]:
+            self.assign(path, b["value"])
+
+        achildren = a["children"]
+        bchildren = b["children"]
+        siblings = _Siblings(path, [child["label"] for child in achildren])
+        # Skip identical subtrees first, then pair the remaining children
+        # by label
+        matcher = difflib.SequenceMatcher(
+            None, [(c["label"], self.hashes[id(c)]) for c in achildren],
+            [(c["label"], self.hashes[id(c)]) for c in bchildren], False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                for i in range(i1, i2):
+                    siblings.advance()
+                continue
+            olds = achildren[i1:i2]
+            news = bchildren[j1:j2]
+            labels = difflib.SequenceMatcher(
+                None, [c["label"] for c in olds], [c["label"] for c in news],
+                False)
+            for ltag, k1, k2, l1, l2 in labels.get_opcodes():
+                if ltag == "equal":
+                    for old, new in zip(olds[k1:k2], news[l1:l2]):
+                        self.compare(siblings.advance(), old, new)
+                    continue
+                for k in range(k1, k2):
+                    self.ops.append(("remove",
+                                     siblings.path_at(siblings.pos)))
+                    del siblings.labels[siblings.pos]
+                for new in news[l1:l2]:
+                    self.insert(siblings, new)
+
+    def insert(self, siblings, node):
+        label = node["label"]
+        pos = siblings.pos
+        if pos > 0:
+            self.ops.append(("insert", siblings.path_at(pos - 1), label,
+                             False))
+        elif siblings.labels:
+            self.ops.append(("insert", siblings.path_at(pos), label, True))
+        siblings.labels.insert(pos, label)
+        cpath = siblings.advance()
+        if len(siblings.labels) == 1 or node["value"] is not None:
+            # set() or clear() creates the only child of a node
+            self.assign(cpath, node["value"])
+        self.create(cpath, node)
+
+
+def diff_trees(a, b, prefix):
+    """
+    Compute the changes that turn the snapshot `a` of the node at `prefix`
+    into the snapshot `b`, as described for :func:`augeas.diff`. Both are
+    lists of at most one node in the format returned by
+    :func:`~augeas.Augeas.dump`.
+
+    :rtype: list(tuple)
+    """
+
+    hashes = {}
+    _tree_hashes(a, hashes)
+    _tree_hashes(b, hashes)
+    differ = _Differ(hashes)
+    if a and b:
+        differ.compare(prefix, a[0], b[0])
+    elif a:
+        differ.ops.append(("remove", prefix))
+    elif b:
+        differ.assign(prefix, b[0]["value"])
+        differ.create(prefix, b[0])
+    return differ.ops
+
+
+__all__ = ['diff_trees']
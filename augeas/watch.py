@@ -0,0 +1,327 @@
+"""
+Keep the tree of an :class:`~augeas.Augeas` handle in sync with the files on
+disk.
+
+A handle that stays open for a long time does not notice when other programs
+edit the files it has loaded. A :class:`Watcher` watches those files and loads
+the ones that changed again with :func:`~augeas.Augeas.refresh`. On Linux it
+is woken up by inotify; elsewhere it checks the files at a fixed interval.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+# Constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+         IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+_EVENT = struct.Struct("iIII")
+
+
+def _fsencode(path):
+    if isinstance(path, bytes):
+        return path
+    return path.encode(sys.getfilesystemencoding())
+
+
+def _fsdecode(path):
+    if isinstance(path, str):
+        return path
+    return path.decode(sys.getfilesystemencoding())
+
+
+class _Inotify(object):
+    "A minimal binding of the Linux inotify API"
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        # Raises AttributeError where inotify does not exist
+        self._init = libc.inotify_init1
+        self._add_watch = libc.inotify_add_watch
+        self._rm_watch = libc.inotify_rm_watch
+
+        self.fd = self._init(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise()
+
+    def _raise(self):
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path):
+        wd = self._add_watch(self.fd, _fsencode(path), _MASK)
+        if wd < 0:
+            self._raise()
+        return wd
+
+    def rm_watch(self, wd):
+        # Fails harmlessly if the watch is already gone
+        self._rm_watch(self.fd, wd)
+
+    def read(self):
+        "Return the pending events as a list of (wd, mask, name)"
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    return events
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                events.append((wd, mask, _fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher(object):
+    """
+    Watch the files loaded into `aug` and reload them when they change.
+
+    The watched files are the ones recorded under :samp:`/augeas/files`; the
+    list is updated whenever the tree changes. Files created after they would
+    have been loaded are not picked up, call :func:`~augeas.Augeas.load` for
+    that.
+
+    Changes can be processed from the thread that uses the handle by calling
+    :func:`process` regularly, or from a background thread started with
+    :func:`start`. In the latter case `aug` must be a
+    :class:`~augeas.ThreadSafeAugeas`: the watcher holds its lock while it
+    updates the tree, so readers never see a file half reloaded.
+
+    After files have been reloaded, every callback is called with the list of
+    their names, without the lock held.
+    """
+
+    def __init__(self, aug, callback=None, interval=2.0, delay=0.05,
+                 inotify=None):
+        """
+        :param aug: the handle to keep up to date
+        :type aug: :class:`~augeas.Augeas`
+        :param callback: a callable to add with :func:`add_callback`
+        :param interval: the number of seconds between two checks of every
+                         file when inotify is not used
+        :type interval: float
+        :param delay: the number of seconds to wait for more events after a
+                      change was noticed, so that a burst of changes is
+                      processed at once
+        :type delay: float
+        :param inotify: :py:obj:`True` to require inotify, :py:obj:`False`
+                        to always check the files at `interval`, or
+                        :py:obj:`None` to use inotify where available
+        """
+
+        self.aug = aug
+        self.interval = interval
+        self.delay = delay
+        #: the exception that stopped the background thread, if any
+        self.error = None
+
+        self._callbacks = []
+        if callback is not None:
+            self._callbacks.append(callback)
+        self._lock = getattr(aug, "lock", None) or threading.RLock()
+        self._root = aug.get("/augeas/root").rstrip("/")
+
+        self._inotify = None
+        if inotify is not False:
+            try:
+                self._inotify = _Inotify()
+            except (AttributeError, OSError):
+                if inotify:
+                    raise
+        # directory -> watch descriptor, and back
+        self._wds = {}
+        self._dirs = {}
+        self._files = set()
+        self._generation = None
+
+        self._thread = None
+        self._stopping = threading.Event()
+        self._wakeup = None
+        if self._inotify is not None:
+            self._wakeup = os.pipe()
+
+    @property
+    def inotify(self):
+        "Whether changes are noticed through inotify"
+        return self._inotify is not None
+
+    def add_callback(self, callback):
+        "Call `callback` with the names of the files reloaded from now on"
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self._callbacks.remove(callback)
+
+    def _sync(self):
+        # Must be called with self._lock held. Update the watched files from
+        # /augeas/files and check the ones that were not watched yet.
+        if self.aug.generation == self._generation:
+            return []
+        files = set(self.aug._tracked_files())
+        # refresh() records the state of the new files, later changes to
+        # them are detected even within the second they were loaded in
+        changed = self.aug.refresh(sorted(files - self._files))
+        if changed:
+            files = set(self.aug._tracked_files())
+        self._files = files
+        self._generation = self.aug.generation
+
+        if self._inotify is not None:
+            dirs = set(os.path.dirname(self._root + f) for f in files)
+            for directory in set(self._wds) - dirs:
+                wd = self._wds.pop(directory)
+                self._dirs.pop(wd, None)
+                self._inotify.rm_watch(wd)
+            for directory in dirs - set(self._wds):
+                try:
+                    wd = self._inotify.add_watch(directory)
+                except OSError:
+                    continue
+                self._wds[directory] = wd
+                self._dirs[wd] = directory
+        return changed
+
+    def _wait(self, timeout):
+        # Return the files that may have changed within `timeout` seconds,
+        # or None if all of them should be checked
+        if self._inotify is None:
+            if self._stopping.wait(timeout):
+                return []
+            return None
+
+        fds = [self._inotify.fd, self._wakeup[0]]
+        ready = select.select(fds, [], [], timeout)[0]
+        if self._wakeup[0] in ready:
+            os.read(self._wakeup[0], 1)
+        if self._inotify.fd not in ready:
+            return []
+
+        # Let a burst of changes, e.g. a rename over the file, settle
+        if self.delay:
+            time.sleep(self.delay)
+
+        candidates = set()
+        prefix = len(self._root)
+        for wd, mask, name in self._inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                return None
+            directory = self._dirs.get(wd)
+            if directory is None:
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                # The directory itself is gone, so are the files in it
+                candidates.update(f for f in self._files
+                                  if os.path.dirname(self._root + f) ==
+                                  directory)
+                self._wds.pop(directory, None)
+                self._dirs.pop(wd, None)
+                self._generation = None
+            elif name:
+                candidates.add(os.path.join(directory, name)[prefix:])
+        return sorted(candidates & self._files)
+
+    def process(self, timeout=0):
+        """
+        Wait at most `timeout` seconds for watched files to change, reload the
+        ones that did and call the callbacks.
+
+        :returns: the names of the files that were reloaded or removed
+        :rtype: list(str)
+        """
+
+        with self._lock:
+            changed = self._sync()
+        candidates = self._wait(timeout)
+        if candidates is None or candidates:
+            with self._lock:
+                changed.extend(self.aug.refresh(candidates))
+                self._sync()
+        if changed:
+            for callback in list(self._callbacks):
+                callback(changed)
+        return changed
+
+    def _run(self):
+        try:
+            while not self._stopping.is_set():
+                self.process(self.interval)
+        except Exception as e:
+            self.error = e
+
+    def start(self):
+        """
+        Process changes in a background thread until :func:`stop` is called.
+        If processing fails, e.g. because the handle has been closed, the
+        thread stops and the exception is stored in :attr:`error`.
+        """
+
+        if not hasattr(self.aug, "lock"):
+            raise TypeError("aug MUST be a ThreadSafeAugeas object!")
+        if self._thread is not None:
+            raise RuntimeError("The watcher has already been started!")
+
+        self._stopping.clear()
+        self.error = None
+        self._thread = threading.Thread(target=self._run,
+                                        name="augeas-watcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        "Stop the background thread started with :func:`start`"
+
+        if self._thread is None:
+            return
+        self._stopping.set()
+        if self._wakeup is not None:
+            os.write(self._wakeup[1], b"x")
+        self._thread.join()
+        self._thread = None
+
+    def close(self):
+        "Stop watching and release the inotify instance"
+
+        self.stop()
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+            for fd in self._wakeup:
+                os.close(fd)
+            self._wakeup = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+__all__ = ['Watcher']
@@ -0,0 +1,560 @@
+"""
+Benchmarks for the python-augeas bindings.
+
+Run all benchmarks with ``python test/benchmark.py``, or only some of them
+by passing their names on the command line.
+"""
+
+from __future__ import print_function
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import timeit
+
+__mydir = os.path.dirname(os.path.abspath(__file__))
+if not os.path.isdir(__mydir):
+    __mydir = os.getcwd()
+
+sys.path.insert(0, __mydir + "/..")
+
+import augeas
+
+MYROOT = __mydir + "/testroot"
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    BENCHMARKS.append(func)
+    return func
+
+
+def make_root(files):
+    "Create a temporary root containing `files`, a dict of path to text"
+    root = tempfile.mkdtemp(prefix="augeas-bench-")
+    atexit.register(shutil.rmtree, root, True)
+    for name, text in files.items():
+        path = os.path.join(root, name.lstrip("/"))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as fp:
+            fp.write(text)
+    return root
+
+
+def hosts_text(entries):
+    "Return the text of an /etc/hosts file with `entries` entries"
+    return "".join("10.%d.%d.%d\thost%d.example.com host%d\n"
+                   % (i >> 16 & 255, i >> 8 & 255, i & 255, i, i)
+                   for i in range(entries))
+
+
+def best(func, number=1, repeat=5):
+    "Return the best time per call of `func`, in seconds"
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def report(name, seconds, baseline=None):
+    line = "  %-40s %12.3f ms" % (name, seconds * 1000)
+    if baseline:
+        line += "  (%.1fx)" % (baseline / seconds)
+    print(line)
+
+
+@benchmark
+def dump():
+    "dump() against match() and get() on every node of test/testroot/etc"
+    a = augeas.Augeas(root=MYROOT)
+
+    def naive():
+        for path in a.match("/files/etc//*"):
+            a.get(path)
+
+    def bulk():
+        a.dump("/files/etc")
+
+    baseline = best(naive)
+    report("match() + get() per node", baseline)
+    report("dump()", best(bulk), baseline)
+    a.close()
+
+
+@benchmark
+def match_values():
+    "match_values() against match() and get() on a 10000 entry /etc/hosts"
+    a = augeas.Augeas(root=make_root({"/etc/hosts": hosts_text(10000)}))
+    expr = "/files/etc/hosts/*/ipaddr"
+
+    def naive():
+        [(path, a.get(path)) for path in a.match(expr)]
+
+    def bulk():
+        a.match_values(expr)
+
+    baseline = best(naive)
+    report("match() + get() per node", baseline)
+    report("match_values()", best(bulk), baseline)
+    a.close()
+
+
+@benchmark
+def aio():
+    "AsyncAugeas: 8 concurrent match() calls on 1 handle against 4 handles"
+    if sys.version_info < (3, 5):
+        print("  skipped, augeas.aio requires Python 3.5")
+        return
+
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from augeas.aio import AsyncAugeas
+
+    executor = ThreadPoolExecutor(4)
+    handles = [AsyncAugeas(augeas.Augeas(root=MYROOT), executor)
+               for i in range(4)]
+    loop = asyncio.new_event_loop()
+
+    def run(count):
+        calls = [handles[i % count].match("/files/etc//*") for i in range(8)]
+        loop.run_until_complete(asyncio.gather(*calls))
+
+    baseline = best(lambda: run(1))
+    report("1 handle", baseline)
+    report("4 handles", best(lambda: run(4)), baseline)
+
+    for handle in handles:
+        loop.run_until_complete(handle.close())
+    loop.close()
+    executor.shutdown()
+
+
+@benchmark
+def threads():
+    "ThreadSafeAugeas: 8 match() calls from 4 threads on 1 and 4 handles"
+    handles = [augeas.ThreadSafeAugeas(root=MYROOT) for i in range(4)]
+
+    def run(nthreads, nhandles):
+        def work(aug):
+            for i in range(8 // nthreads):
+                aug.match("/files/etc//*")
+        threads = [threading.Thread(target=work, args=(handles[i % nhandles],))
+                   for i in range(nthreads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    baseline = best(lambda: run(1, 1))
+    report("1 thread, 1 handle", baseline)
+    report("4 threads, 1 handle", best(lambda: run(4, 1)), baseline)
+    report("4 threads, 4 handles", best(lambda: run(4, 4)), baseline)
+    for aug in handles:
+        aug.close()
+
+
+@benchmark
+def refresh():
+    "refresh() against load() after changing one file in test/testroot"
+    root = make_root({})
+    shutil.rmtree(root)
+    shutil.copytree(MYROOT, root)
+    a = augeas.Augeas(root=root)
+    hosts = os.path.join(root, "etc", "hosts")
+
+    def touch():
+        with open(hosts, "a") as fp:
+            fp.write("10.0.0.1 host.example.com\n")
+
+    baseline = best(lambda: (touch(), a.load()))
+    report("load()", baseline)
+    a.refresh()
+    report("refresh()", best(lambda: (touch(), a.refresh())), baseline)
+    a.close()
+
+
+@benchmark
+def parse_cache():
+    "Loading test/testroot with and without a ParseCache"
+    from augeas.cache import ParseCache
+
+    directory = make_root({})
+
+    def cached(clear):
+        cache = ParseCache(directory)
+        if clear:
+            cache.clear()
+        a = augeas.Augeas(root=MYROOT, flags=augeas.Augeas.NO_LOAD)
+        cache.load(a)
+        a.close()
+
+    baseline = best(lambda: augeas.Augeas(root=MYROOT).close())
+    report("Augeas()", baseline)
+    report("ParseCache.load(), cold", best(lambda: cached(True)), baseline)
+    cached(False)
+    report("ParseCache.load(), warm", best(lambda: cached(False)), baseline)
+
+
+@benchmark
+def parallel_load():
+    "parallel_load() against load() on 2000 interface files and /etc/hosts"
+    files = {"/etc/hosts": hosts_text(20000)}
+    for i in range(2000):
+        files["/etc/sysconfig/network-scripts/ifcfg-eth%d" % i] = (
+            "DEVICE=eth%d\nBOOTPROTO=static\nIPADDR=10.0.%d.%d\n"
+            "ONBOOT=yes\n" % (i, i >> 8, i & 255))
+    root = make_root(files)
+
+    def run(workers):
+        a = augeas.Augeas(root=root, flags=augeas.Augeas.NO_LOAD)
+        if workers:
+            a.parallel_load(workers)
+        else:
+            a.load()
+        a.close()
+
+    baseline = best(lambda: run(None), repeat=3)
+    report("load()", baseline)
+    for workers in (2, 4, 8):
+        report("parallel_load(%d)" % workers,
+               best(lambda: run(workers), repeat=3), baseline)
+
+
+@benchmark
+def read_cache():
+    "1000 get() and match() calls on 10 paths with and without enable_cache()"
+    a = augeas.Augeas(root=MYROOT)
+    paths = a.match("/files/etc/hosts/*/*")[:10]
+
+    def run():
+        for i in range(100):
+            for path in paths:
+                a.get(path)
+                a.match(path)
+
+    baseline = best(run)
+    report("uncached", baseline)
+    a.enable_cache()
+    report("enable_cache()", best(run), baseline)
+    a.close()
+
+
+@benchmark
+def index():
+    "Looking up 100 values in a 10000 entry /etc/hosts"
+    a = augeas.Augeas(root=make_root({"/etc/hosts": hosts_text(10000)}))
+    values = ["10.0.%d.%d" % (i >> 8, i & 255) for i in range(0, 10000, 100)]
+
+    def scan():
+        for value in values:
+            a.match("/files/etc/hosts/*/ipaddr[. = '%s']" % value)
+
+    baseline = best(scan, repeat=3)
+    report("match()", baseline)
+    report("build_index()",
+           best(lambda: a.build_index("/files/etc/hosts"), repeat=3))
+    idx = a.build_index("/files/etc/hosts", labels=["ipaddr"])
+    report("Index.lookup()",
+           best(lambda: [idx.lookup(value) for value in values]), baseline)
+    report("set() + Index.lookup()",
+           best(lambda: (a.set("/files/etc/hosts/1/ipaddr", "10.0.0.0"),
+                         idx.lookup("10.0.0.0")), number=100))
+    a.close()
+
+
+@benchmark
+def transaction():
+    "500 changes to a 1000 entry /etc/hosts, saved once"
+    root = make_root({"/etc/hosts": hosts_text(1000)})
+    a = augeas.Augeas(root=root)
+
+    def naive():
+        for i in range(1, 501):
+            a.set("/files/etc/hosts/%d/alias" % i, "alias%d" % i)
+        a.save()
+
+    def batched():
+        with a.transaction() as tx:
+            for i in range(1, 501):
+                tx.set("/files/etc/hosts/%d/alias" % i, "other%d" % i)
+
+    baseline = best(naive, repeat=3)
+    report("set() + save()", baseline)
+    report("transaction()", best(batched, repeat=3), baseline)
+
+    # An index is updated after every set(), but rebuilt once after a
+    # transaction
+    index = a.build_index("/files/etc/hosts")
+    baseline = best(lambda: (naive(), index.lookup("alias1")), repeat=3)
+    report("set() + save(), indexed", baseline)
+    report("transaction(), indexed",
+           best(lambda: (batched(), index.lookup("alias1")), repeat=3),
+           baseline)
+    a.close()
+
+
+@benchmark
+def load_dict():
+    "Building an /etc/hosts tree of 100 to 100000 entries"
+    def entries(count):
+        return [(str(i), [("ipaddr", "10.%d.%d.%d" % (i >> 16 & 255,
+                                                      i >> 8 & 255, i & 255)),
+                          ("canonical", "host%d.example.com" % i)])
+                for i in range(1, count + 1)]
+
+    for count in (100, 1000, 10000, 100000):
+        data = entries(count)
+        a = augeas.Augeas(root=make_root({}), flags=augeas.Augeas.NO_LOAD |
+                          augeas.Augeas.NO_MODL_AUTOLOAD)
+
+        def naive():
+            a.remove("/files/etc/hosts")
+            for label, children in data:
+                for child, value in children:
+                    a.set("/files/etc/hosts/%s/%s" % (label, child), value)
+
+        def bulk():
+            a.remove("/files/etc/hosts")
+            a.load_dict("/files/etc/hosts", data)
+
+        baseline = None
+        if count <= 10000:
+            baseline = best(naive, repeat=1)
+            report("set(), %d entries" % count, baseline)
+        report("load_dict(), %d entries" % count, best(bulk, repeat=1),
+               baseline)
+        a.close()
+
+
+@benchmark
+def diff():
+    "diff() of two 10000 entry /etc/hosts trees that differ in 10 entries"
+    text = hosts_text(10000)
+    a = augeas.Augeas(root=make_root({"/etc/hosts": text}))
+    b = augeas.Augeas(root=make_root({"/etc/hosts": text}))
+    for i in range(1, 10001, 1000):
+        b.set("/files/etc/hosts/%d/canonical" % i, "changed")
+    prefix = "/files/etc/hosts"
+
+    def naive():
+        dumped = [dict((path, aug.get(path)) for path in
+                       aug.match(prefix + "//*")) for aug in (a, b)]
+        [path for path in dumped[1] if dumped[0].get(path) != dumped[1][path]]
+
+    baseline = best(naive, repeat=3)
+    report("match() + get() and compare", baseline)
+    report("diff()", best(lambda: augeas.diff(a, b, prefix), repeat=3),
+           baseline)
+    a.close()
+    b.close()
+
+
+@benchmark
+def plan():
+    "plan() after changing 200 of 2000 interface files"
+    files = {}
+    for i in range(2000):
+        files["/etc/sysconfig/network-scripts/ifcfg-eth%d" % i] = (
+            "DEVICE=eth%d\nONBOOT=yes\n" % i)
+    a = augeas.Augeas(root=make_root(files))
+    for i in range(0, 2000, 10):
+        a.set("/files/etc/sysconfig/network-scripts/ifcfg-eth%d/ONBOOT" % i,
+              "no")
+
+    report("plan()", best(a.plan, repeat=3))
+    a.close()
+
+
+@benchmark
+def export():
+    "Exporting a 10000 entry /etc/hosts with to_xml(), to_json() and dump()"
+    a = augeas.Augeas(root=make_root({"/etc/hosts": hosts_text(10000)}))
+    path = "/files/etc/hosts"
+
+    def naive():
+        for node in a.match(path + "//*"):
+            a.get(node)
+
+    baseline = best(naive, repeat=3)
+    report("match() + get() per node", baseline)
+    report("dump()", best(lambda: a.dump(path), repeat=3), baseline)
+    report("to_xml()", best(lambda: a.to_xml(path), repeat=3), baseline)
+    report("to_json()", best(lambda: a.to_json(path), repeat=3), baseline)
+    report("print_tree()", best(lambda: a.print_tree(path), repeat=3),
+           baseline)
+    a.close()
+
+
+@benchmark
+def parse():
+    "Parsing a 1000 entry hosts file held in memory"
+    a = augeas.Augeas(root=MYROOT, flags=augeas.Augeas.NO_LOAD)
+    text = hosts_text(1000)
+    scratch = "/augeas/python/bench"
+
+    def naive():
+        a.set(scratch + "/in", text)
+        a.text_store("Hosts.lns", scratch + "/in", scratch + "/tree")
+        [(path, a.get(path)) for path in a.match(scratch + "/tree//*")]
+        a.remove(scratch)
+
+    baseline = best(naive, repeat=3)
+    report("set() + text_store() + get()", baseline)
+    data = text.encode()
+    report("parse()", best(lambda: a.parse("Hosts.lns", data), repeat=3),
+           baseline)
+    tree = a.parse("Hosts.lns", data)
+    report("render()",
+           best(lambda: a.render("Hosts.lns", tree, data), repeat=3))
+    a.close()
+
+
+@benchmark
+def archive():
+    "Parsing a layer of 1000 interface files against extracting and loading"
+    import io
+    import tarfile
+    from augeas.archive import iter_archive
+
+    layer = io.BytesIO()
+    with tarfile.open(fileobj=layer, mode="w:gz") as tar:
+        for i in range(1000):
+            data = ("DEVICE=eth%d\nONBOOT=yes\n" % i).encode()
+            info = tarfile.TarInfo(
+                "etc/sysconfig/network-scripts/ifcfg-eth%d" % i)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    data = layer.getvalue()
+
+    def extract():
+        root = tempfile.mkdtemp(prefix="augeas-bench-")
+        try:
+            with tarfile.open(fileobj=io.BytesIO(data), mode="r|*") as tar:
+                tar.extractall(root)
+            a = augeas.Augeas(root=root)
+            a.dump("/files")
+            a.close()
+        finally:
+            shutil.rmtree(root)
+
+    a = augeas.Augeas(root=MYROOT, flags=augeas.Augeas.NO_LOAD)
+    baseline = best(extract, repeat=3)
+    report("extract + Augeas() + dump()", baseline)
+    report("iter_archive()",
+           best(lambda: list(iter_archive(a, io.BytesIO(data))), repeat=3),
+           baseline)
+    a.close()
+
+
+@benchmark
+def lens_for():
+    "Finding the lens of 100 files with the autoloaded transforms"
+    import fnmatch
+
+    a = augeas.Augeas(root=MYROOT, flags=augeas.Augeas.NO_LOAD)
+    files = ["/etc/file%d.conf" % i for i in range(50)] + \
+        ["/etc/sysconfig/network-scripts/ifcfg-eth%d" % i for i in range(50)]
+
+    def naive():
+        for filename in files:
+            for xfm in a.match("/augeas/load/*"):
+                incl = [a.get(p) for p in a.match(xfm + "/incl")]
+                excl = [a.get(p) for p in a.match(xfm + "/excl")]
+                if any(fnmatch.fnmatch(filename, p) for p in incl) and \
+                        not any(fnmatch.fnmatch(filename, p) for p in excl):
+                    break
+
+    baseline = best(naive, repeat=3)
+    report("match() + get() + fnmatch", baseline)
+    a.lens_for("/etc/hosts")
+    report("lens_for()", best(lambda: [a.lens_for(f) for f in files]),
+           baseline)
+    a.close()
+
+
+@benchmark
+def for_files():
+    "Startup time and memory of Augeas() and for_files() with 15 files"
+    import subprocess
+
+    files = ["/etc/hosts", "/etc/fstab", "/etc/passwd", "/etc/group",
+             "/etc/resolv.conf", "/etc/sudoers", "/etc/sysctl.conf",
+             "/etc/ntp.conf", "/etc/nsswitch.conf", "/etc/inittab",
+             "/etc/crontab", "/etc/exports", "/etc/yum.conf",
+             "/etc/logrotate.conf",
+             "/etc/sysconfig/network-scripts/ifcfg-eth0"]
+    cache_dir = make_root({})
+    script = """
+import resource, sys, time
+sys.path.insert(0, %r)
+import augeas
+start = time.time()
+if sys.argv[1] == "default":
+    augeas.Augeas(root=%r)
+elif sys.argv[1] == "uncached":
+    augeas.Augeas.for_files(%r, root=%r)
+else:
+    augeas.Augeas.for_files(%r, root=%r, cache_dir=%r)
+print(time.time() - start,
+      resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+""" % (__mydir + "/..", MYROOT, files, MYROOT, files, MYROOT, cache_dir)
+
+    def run(mode):
+        results = []
+        for i in range(3):
+            out = subprocess.check_output([sys.executable, "-c", script, mode])
+            results.append([float(field) for field in out.split()])
+        return min(results)
+
+    baseline, baseline_rss = run("default")
+    report("Augeas()", baseline)
+    uncached, uncached_rss = run("uncached")
+    report("for_files(), no cache_dir", uncached, baseline)
+    run("for_files")
+    seconds, rss = run("for_files")
+    report("for_files(), cached transforms", seconds, baseline)
+    print("  %-40s %12d kB" % ("Augeas() max RSS", baseline_rss))
+    print("  %-40s %12d kB" % ("for_files(), no cache_dir max RSS",
+                                uncached_rss))
+    print("  %-40s %12d kB" % ("for_files() max RSS", rss))
+
+
+@benchmark
+def accessors():
+    "10000 calls of each accessor, on CPython or PyPy"
+    import platform
+
+    print("  %s %s" % (platform.python_implementation(),
+                       platform.python_version()))
+    a = augeas.Augeas(root=MYROOT, flags=augeas.Augeas.ENABLE_SPAN)
+    path = "/files/etc/hosts/1/ipaddr"
+    a.defvar("addrs", "/files/etc/hosts/*/ipaddr")
+    calls = [
+        ("get()", lambda: a.get(path)),
+        ("label()", lambda: a.label(path)),
+        ("source()", lambda: a.source(path)),
+        ("span()", lambda: a.span(path)),
+        ("ns_value()", lambda: a.ns_value("addrs", 0)),
+        ("ns_label()", lambda: a.ns_label("addrs", 0)),
+        ("ns_attr()", lambda: a.ns_attr("addrs", 0)),
+        ("ns_path()", lambda: a.ns_path("addrs", 0)),
+    ]
+    for name, func in calls:
+        # Let a JIT warm up before measuring
+        best(func, number=10000, repeat=2)
+        report(name, best(func, number=10000) * 10000)
+    a.close()
+
+
+def main(names):
+    for func in BENCHMARKS:
+        if names and func.__name__ not in names:
+            continue
+        print("%s: %s" % (func.__name__, func.__doc__))
+        func()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
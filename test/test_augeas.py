@@ -1,7 +1,14 @@
 from __future__ import print_function
 
+import gc
+import io
+import json
 import os
+import shutil
 import sys
+import tarfile
+import tempfile
+import threading
 import unittest
 
 __mydir = os.path.dirname(os.path.abspath(__file__))
@@ -11,6 +18,10 @@ if not os.path.isdir(__mydir):
 sys.path.insert(0, __mydir + "/..")
 
 import augeas
+from augeas.archive import iter_archive
+from augeas.cache import ParseCache
+from augeas.pool import AugeasPool
+from augeas.watch import Watcher
 
 MYROOT = __mydir + "/testroot"
 
@@ -35,6 +46,14 @@ def recurmatch(aug, path):
 
 
 class TestAugeas(unittest.TestCase):
+    def copyroot(self):
+        "return a scratch copy of MYROOT that is removed after the test"
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        root = os.path.join(tmpdir, "testroot")
+        shutil.copytree(MYROOT, root)
+        return root
+
     def test01aGetNone(self):
         "test aug_get with non-existing path"
         a = augeas.Augeas(root=MYROOT)
@@ -292,6 +311,862 @@ class TestAugeas(unittest.TestCase):
         path = a.ns_path("hosts",2)
         self.assertEqual(path, "/files/etc/hosts/1")
 
+    def test22GetMany(self):
+        "test get_many and label_many"
+        a = augeas.Augeas(root=MYROOT)
+        paths = ["/files/etc/hosts/1/ipaddr", "/wrong/path",
+                 "/files//[1]/", "/files/etc/hosts/1/canonical"]
+        values = a.get_many(paths)
+        self.assertEqual(values[0], "127.0.0.1")
+        self.assertIsNone(values[1])
+        self.assertIsInstance(values[2], augeas.AugeasValueError)
+        self.assertEqual(values[3], a.get("/files/etc/hosts/1/canonical"))
+
+        labels = a.label_many(paths[:1] + paths[3:], as_dict=True)
+        self.assertEqual(labels, {"/files/etc/hosts/1/ipaddr": "ipaddr",
+                                  "/files/etc/hosts/1/canonical": "canonical"})
+
+        self.assertRaises(TypeError, a.get_many, "/files/etc/hosts/1/ipaddr")
+        del a
+
+    def test23Dump(self):
+        "test dump"
+        a = augeas.Augeas(root=MYROOT)
+        trees = a.dump("/files/etc/hosts")
+        self.assertEqual(len(trees), 1)
+        hosts = trees[0]
+        self.assertEqual(hosts["label"], "hosts")
+        self.assertIsNone(hosts["value"])
+        self.assertEqual([c["label"] for c in hosts["children"]],
+                         [a.label(p) for p in a.match("/files/etc/hosts/*")])
+
+        entry = a.dump("/files/etc/hosts/1")[0]
+        self.assertEqual([(c["label"], c["value"]) for c in entry["children"]],
+                         [("ipaddr", "127.0.0.1"),
+                          ("canonical", "localhost.localdomain"),
+                          ("alias", "localhost"),
+                          ("alias", "testhost")])
+        self.assertEqual(entry["children"][0]["children"], [])
+
+        self.assertEqual(a.dump("/wrong/path"), [])
+        self.assertRaises(ValueError, a.dump, "/files//[1]/")
+        del a
+
+    def test24Prepare(self):
+        "test prepare"
+        a = augeas.Augeas(root=MYROOT)
+        q = a.prepare("/files/etc/hosts/*/ipaddr")
+        self.assertEqual(q.paths(), a.match("/files/etc/hosts/*/ipaddr"))
+        self.assertEqual(q.labels(), ["ipaddr", "ipaddr"])
+        self.assertEqual(q.values(), ["127.0.0.1", "::1"])
+
+        generation = a.generation
+        a.get("/files/etc/hosts/1/ipaddr")
+        self.assertEqual(a.generation, generation)
+        a.set("/files/etc/hosts/3/ipaddr", "192.168.0.1")
+        self.assertGreater(a.generation, generation)
+        self.assertEqual(len(q), 3)
+        self.assertEqual(q.values()[-1], "192.168.0.1")
+        q.close()
+
+        with a.prepare("/files/etc/hosts/*[ipaddr = '::1']/canonical") as q:
+            self.assertEqual(q.get(), "localhost.localdomain")
+        self.assertRaises(ValueError, a.prepare, "/files//[1]/")
+
+        # The variable of a query that was not closed is reused
+        q = a.prepare("/files/etc/hosts/*")
+        name = q.name
+        del q
+        gc.collect()
+        q = a.prepare("/files/etc/hosts/1")
+        self.assertEqual(q.name, name)
+        self.assertEqual(q.paths(), ["/files/etc/hosts/1"])
+        q.close()
+        del a
+
+    def test25MatchValues(self):
+        "test match_values and match_attrs"
+        a = augeas.Augeas(root=MYROOT)
+        expr = "/files/etc/hosts/*/ipaddr"
+        self.assertEqual(a.match_values(expr),
+                         [(p, a.label(p), a.get(p)) for p in a.match(expr)])
+
+        attrs = a.match_attrs("/files/etc/hosts/1/*")
+        self.assertEqual(len(attrs), 4)
+        self.assertEqual(attrs[2], ("/files/etc/hosts/1/alias[1]", "alias",
+                                    "localhost", "/files/etc/hosts"))
+
+        self.assertEqual(a.match_values("/wrong/path"), [])
+        self.assertRaises(ValueError, a.match_values, "/files//[1]/")
+        del a
+
+    def test26IterMatch(self):
+        "test iter_match and lazy_match"
+        a = augeas.Augeas(root=MYROOT)
+        expr = "/files/etc/hosts/*"
+        matches = a.match(expr)
+        self.assertEqual(list(a.iter_match(expr)), matches)
+
+        it = a.iter_match(expr)
+        self.assertEqual(next(it), matches[0])
+        it.close()
+        self.assertRaises(StopIteration, next, it)
+
+        result = a.lazy_match(expr)
+        self.assertEqual(len(result), len(matches))
+        self.assertEqual(result[-1], matches[-1])
+        self.assertEqual(result[1:3], matches[1:3])
+        self.assertEqual(list(result), matches)
+        self.assertRaises(IndexError, result.__getitem__, len(matches))
+
+        self.assertRaises(RuntimeError, a.iter_match, "/files//[1]/")
+        del a
+
+    def test27Pool(self):
+        "test AugeasPool"
+        pool = AugeasPool(size=1)
+        with pool.handle(root=MYROOT) as a:
+            a.set("/files/etc/hosts/1/ipaddr", "10.0.0.1")
+        with pool.handle(root=MYROOT) as b:
+            self.assertIs(b, a)
+            self.assertEqual(b.get("/files/etc/hosts/1/ipaddr"), "127.0.0.1")
+            self.assertRaises(RuntimeError, pool.checkout,
+                              root=MYROOT, timeout=0.01)
+        self.assertRaises(ValueError, pool.checkin, a)
+
+        stats = pool.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["waits"]),
+                         (1, 1, 1))
+        self.assertEqual((stats["idle"], stats["busy"]), (1, 0))
+
+        pool.idle_timeout = 0
+        pool.evict()
+        self.assertEqual(pool.stats()["evictions"], 1)
+
+        # Returning a handle wakes up the waiter for its key, even when a
+        # waiter for another key started waiting first
+        flags = augeas.Augeas.NO_LOAD
+        a = pool.checkout(root=MYROOT)
+        b = pool.checkout(root=MYROOT, flags=flags)
+        results = {}
+
+        def wait(name, **kwargs):
+            results[name] = pool.checkout(root=MYROOT, timeout=5, **kwargs)
+
+        waits = pool.stats()["waits"]
+        threads = []
+        for name, kwargs in (("a", {}), ("b", {"flags": flags})):
+            threads.append(threading.Thread(target=wait, args=(name,),
+                                            kwargs=kwargs))
+            threads[-1].start()
+            waits += 1
+            while pool.stats()["waits"] < waits:
+                threads[-1].join(0.01)
+        pool.checkin(b)
+        threads[1].join(2)
+        self.assertIs(results.get("b"), b)
+        pool.checkin(a)
+        threads[0].join(2)
+        self.assertIs(results.get("a"), a)
+        pool.checkin(a)
+        pool.checkin(b)
+        pool.close()
+        self.assertRaises(RuntimeError, pool.checkout, root=MYROOT)
+
+    @unittest.skipIf(sys.version_info < (3, 5),
+                     "augeas.aio requires Python 3.5")
+    def test28AsyncAugeas(self):
+        "test AsyncAugeas"
+        import asyncio
+        from augeas.aio import AsyncAugeas
+
+        loop = asyncio.new_event_loop()
+        try:
+            a = loop.run_until_complete(AsyncAugeas.open(root=MYROOT))
+            value, matches = loop.run_until_complete(asyncio.gather(
+                a.get("/files/etc/hosts/1/ipaddr"),
+                a.match("/files/etc/hosts/*")))
+            self.assertEqual(value, "127.0.0.1")
+            self.assertEqual(matches, a.aug.match("/files/etc/hosts/*"))
+            self.assertRaises(ValueError, loop.run_until_complete,
+                              a.get("/files//[1]/"))
+            self.assertFalse(hasattr(a, "prepare"))
+            paths = loop.run_until_complete(
+                a.run(lambda aug: aug.prepare("/files/etc/hosts/*").paths()))
+            self.assertEqual(paths, matches)
+
+            # A cancelled call still holds the handle until it returns
+            task = loop.create_task(a.load())
+            loop.call_soon(task.cancel)
+            self.assertRaises(asyncio.CancelledError,
+                              loop.run_until_complete, task)
+            value = loop.run_until_complete(a.get("/files/etc/hosts/1/ipaddr"))
+            self.assertEqual(value, "127.0.0.1")
+
+            loop.run_until_complete(a.close())
+        finally:
+            loop.close()
+
+    def test29ThreadSafe(self):
+        "test ThreadSafeAugeas shared between threads"
+        a = augeas.ThreadSafeAugeas(root=MYROOT)
+        errors = []
+
+        def worker(n):
+            try:
+                for i in range(200):
+                    path = "/test/thread%d/%d" % (n, i % 10)
+                    a.set(path, str(i))
+                    if a.get(path) != str(i):
+                        errors.append(path)
+                    a.match("/files/etc/hosts/*")
+                    a.dump("/files/etc/hosts/1")
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n,))
+                   for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(a.match("/test/*/*")), 80)
+
+        # Closing the handle while other threads use it
+        def reader():
+            try:
+                while True:
+                    a.get("/files/etc/hosts/1/ipaddr")
+            except RuntimeError:
+                pass
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=reader) for n in range(4)]
+        for t in threads:
+            t.start()
+        a.close()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+
+    def test30Lazy(self):
+        "test lazy loading"
+        a = augeas.Augeas(root=MYROOT, lazy=True)
+        self.assertEqual(a.match("/augeas/files/etc/*"), [])
+
+        self.assertEqual(a.get("/files/etc/hosts/1/ipaddr"), "127.0.0.1")
+        self.assertEqual(a.match("/augeas/files/etc/*"),
+                         ["/augeas/files/etc/hosts"])
+
+        # A new file does not trigger loading its directory
+        a.set("/files/etc/newfile/key", "value")
+        self.assertEqual(a.match("/augeas/files/etc/fstab"), [])
+
+        # Loaded files are not reloaded, so changes are kept
+        a.set("/files/etc/hosts/1/ipaddr", "10.0.0.1")
+        self.assertEqual(a.get("/files/etc/hosts/*[canonical = "
+                               "'localhost.localdomain'][1]/ipaddr"),
+                         "10.0.0.1")
+
+        scripts = a.match("/files/etc/sysconfig/network-scripts/*")
+        self.assertEqual(len(scripts), 2)
+        self.assertEqual(a.match("/augeas/files/etc/fstab"), [])
+        self.assertTrue(a.match("/files/etc/fstab/*"))
+        del a
+
+    def test31Refresh(self):
+        "test refresh"
+        root = self.copyroot()
+        a = augeas.Augeas(root=root)
+        self.assertEqual(a.refresh(), [])
+
+        with open(root + "/etc/hosts", "a") as hosts:
+            hosts.write("192.168.0.1\trtr.example.com router\n")
+        os.remove(root + "/etc/fstab")
+        self.assertEqual(a.refresh(), ["/etc/fstab", "/etc/hosts"])
+        self.assertEqual(a.get("/files/etc/hosts/3/canonical"),
+                         "rtr.example.com")
+        self.assertEqual(a.match("/files/etc/fstab"), [])
+        self.assertEqual(a.match("/augeas/files/etc/fstab"), [])
+
+        self.assertEqual(a.refresh(), [])
+
+        # Names that need escaping in a path
+        shutil.copy(root + "/etc/hosts", root + "/etc/my hosts")
+        a.transform("Hosts", "/etc/my hosts")
+        a.load_file("/etc/my hosts")
+        with open(root + "/etc/my hosts", "a") as hosts:
+            hosts.write("192.168.0.2\tgw.example.com\n")
+        self.assertEqual(a.refresh(), ["/etc/my hosts"])
+        # The old tree was removed, not kept next to the new one
+        self.assertEqual(a.get("/files/etc/my\\ hosts/4/canonical"),
+                         "gw.example.com")
+        self.assertEqual(a.match("/files/etc/my\\ hosts/5"), [])
+        self.assertEqual(a.refresh(), [])
+        del a
+
+    def test32Watcher(self):
+        "test Watcher"
+        root = self.copyroot()
+        a = augeas.ThreadSafeAugeas(root=root)
+
+        def append(entry):
+            with open(root + "/etc/hosts", "a") as hosts:
+                hosts.write(entry + "\n")
+
+        for inotify in (None, False):
+            with Watcher(a, interval=0, inotify=inotify) as watcher:
+                self.assertEqual(watcher.process(), [])
+                append("192.168.0.1 rtr.example.com")
+                self.assertEqual(watcher.process(1), ["/etc/hosts"])
+                self.assertEqual(a.get("/files/etc/hosts/3/canonical"),
+                                 "rtr.example.com")
+                a.remove("/files/etc/hosts/3")
+                a.save()
+                watcher.process()
+
+        seen = []
+        done = threading.Event()
+
+        def changed(files):
+            seen.append(files)
+            done.set()
+
+        with Watcher(a, callback=changed, interval=0.05) as watcher:
+            watcher.process()
+            watcher.start()
+            append("192.168.0.2 gw.example.com")
+            self.assertTrue(done.wait(5))
+            watcher.stop()
+            self.assertEqual(seen, [["/etc/hosts"]])
+            self.assertIsNone(watcher.error)
+        self.assertEqual(a.get("/files/etc/hosts/3/canonical"),
+                         "gw.example.com")
+        a.close()
+
+    def test33ParseCache(self):
+        "test ParseCache"
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        cache = ParseCache(tmpdir + "/cache")
+
+        a = augeas.Augeas(root=MYROOT, flags=augeas.Augeas.NO_LOAD)
+        cache.load(a)
+        self.assertEqual(cache.hits, 0)
+        self.assertTrue(cache.misses > 0)
+        misses = cache.misses
+
+        b = augeas.Augeas(root=MYROOT, flags=augeas.Augeas.NO_LOAD)
+        cache.load(b)
+        self.assertTrue(cache.hits > 0)
+        hits = cache.hits
+        self.assertEqual(cache.hits + cache.misses, 2 * misses)
+
+        plain = augeas.Augeas(root=MYROOT)
+        for node in plain.match("/augeas/files//path"):
+            path = plain.get(node)
+            self.assertEqual(b.dump(path), plain.dump(path))
+            self.assertEqual(b.get(node), path)
+        self.assertEqual(b.get("/files/etc/hosts/1/ipaddr"), "127.0.0.1")
+
+        cache.clear()
+        c = augeas.Augeas(root=MYROOT, flags=augeas.Augeas.NO_LOAD)
+        cache.load(c)
+        self.assertEqual(cache.misses, 2 * misses)
+
+        # Names that need escaping in a path
+        root = self.copyroot()
+        with open(root + "/etc/my hosts", "w") as hosts:
+            hosts.write("192.168.0.1\trtr.example.com\n")
+        trees = []
+        for i in range(2):
+            d = augeas.Augeas(root=root, flags=augeas.Augeas.NO_LOAD)
+            cache.load_file(d, "/etc/my hosts", "Hosts.lns")
+            trees.append(d.dump("/files/etc/my\\ hosts"))
+            self.assertEqual(d.get("/augeas/files/etc/my\\ hosts/path"),
+                             "/files/etc/my hosts")
+            d.close()
+        self.assertEqual(cache.hits, hits + 1)
+        self.assertEqual(trees[0], trees[1])
+        self.assertIsNone(trees[1][0]["value"])
+        del a, b, c, plain
+
+    def test34ParallelLoad(self):
+        "test parallel_load"
+        a = augeas.Augeas(root=MYROOT, flags=augeas.Augeas.NO_LOAD)
+        a.parallel_load(workers=3)
+        b = augeas.Augeas(root=MYROOT)
+
+        self.assertEqual(sorted(a.match_values("/augeas/files//path")),
+                         sorted(b.match_values("/augeas/files//path")))
+        for path in b.match("/augeas/files//path"):
+            node = b.get(path)
+            info = path[:-len("/path")]
+            self.assertEqual(a.dump(node), b.dump(node))
+            self.assertEqual(a.dump(info), b.dump(info))
+        self.assertEqual(a.get("/files/etc/hosts/1/ipaddr"), "127.0.0.1")
+        # Saving would rewrite every file
+        self.assertRaises(RuntimeError, a.save)
+        del a, b
+
+        # Names that need escaping in a path
+        root = self.copyroot()
+        with open(root + "/etc/my hosts", "w") as hosts:
+            hosts.write("192.168.0.1\trtr.example.com\n")
+        a = augeas.Augeas(root=root, flags=augeas.Augeas.NO_LOAD)
+        a.transform("Hosts", "/etc/my hosts")
+        a.parallel_load(workers=2)
+        self.assertEqual(a.get("/files/etc/my\\ hosts/1/canonical"),
+                         "rtr.example.com")
+        self.assertEqual(a.get("/augeas/files/etc/my\\ hosts/path"),
+                         "/files/etc/my hosts")
+        a.load()
+        a.save()
+        del a
+
+    def test35Cache(self):
+        "test enable_cache"
+        a = augeas.Augeas(root=MYROOT)
+        a.enable_cache(maxsize=2)
+        path = "/files/etc/hosts/1/ipaddr"
+        self.assertEqual(a.get(path), "127.0.0.1")
+        self.assertEqual(a.get(path), "127.0.0.1")
+        self.assertEqual(a.cache_info(), augeas.CacheInfo(1, 1, 2, 1))
+
+        matches = a.match("/files/etc/hosts/*")
+        matches.append("junk")
+        self.assertEqual(a.match("/files/etc/hosts/*"), matches[:-1])
+        self.assertEqual(a.cache_info().hits, 2)
+
+        a.set(path, "127.0.0.2")
+        self.assertEqual(a.get(path), "127.0.0.2")
+        self.assertEqual(a.cache_info().currsize, 1)
+        a.label(path)
+        a.get("/files/etc/hosts/2/ipaddr")
+        self.assertEqual(a.cache_info().currsize, 2)
+
+        a.disable_cache()
+        self.assertEqual(a.cache_info().currsize, 0)
+
+        # Cached results must not outlive the handle
+        a.enable_cache()
+        a.match("/files/etc/hosts/*")
+        a.close()
+        self.assertRaises(RuntimeError, a.match, "/files/etc/hosts/*")
+        del a
+
+    def test36Index(self):
+        "test build_index"
+        a = augeas.Augeas(root=MYROOT)
+        index = a.build_index("/files/etc/hosts")
+        self.assertEqual(index.lookup("127.0.0.1"),
+                         ["/files/etc/hosts/1/ipaddr"])
+        self.assertEqual(index.lookup("testhost"),
+                         ["/files/etc/hosts/1/alias[2]"])
+        self.assertEqual(index.labelled("ipaddr"),
+                         ["/files/etc/hosts/1/ipaddr",
+                          "/files/etc/hosts/2/ipaddr"])
+
+        # Incremental updates
+        a.set("/files/etc/hosts/3/ipaddr", "192.168.0.1")
+        self.assertEqual(index.lookup("192.168.0.1"),
+                         ["/files/etc/hosts/3/ipaddr"])
+        self.assertEqual(index.labelled("3"), ["/files/etc/hosts/3"])
+        a.remove("/files/etc/hosts/1/alias[1]")
+        self.assertEqual(index.lookup("testhost"),
+                         ["/files/etc/hosts/1/alias"])
+        a.move("/files/etc/hosts/3", "/files/etc/hosts/4")
+        self.assertEqual(index.lookup("192.168.0.1"),
+                         ["/files/etc/hosts/4/ipaddr"])
+        a.set("/files/etc/fstab/1/spec", "/dev/sda1")
+        self.assertEqual(index.rebuilds, 1)
+
+        # Other changes rebuild the index
+        a.insert("/files/etc/hosts/1", "0")
+        self.assertTrue("127.0.0.1" in index)
+        self.assertEqual(index.rebuilds, 2)
+
+        labelled = a.build_index("/files/etc/hosts", labels=["canonical"])
+        self.assertEqual(labelled.lookup("127.0.0.1"), [])
+        self.assertEqual(len(labelled.lookup("localhost.localdomain")), 2)
+        del a
+
+        # Rebuilds of an index shared between threads
+        shared = augeas.ThreadSafeAugeas(root=MYROOT)
+        shared_index = shared.build_index("/files/etc/hosts")
+        errors = []
+
+        def worker(n):
+            try:
+                for i in range(50):
+                    # Each insert makes the next lookup rebuild the index
+                    shared.insert("/files/etc/hosts/1", "new%d" % n)
+                    if shared_index.lookup("127.0.0.1") != \
+                            ["/files/etc/hosts/1/ipaddr"]:
+                        errors.append(i)
+                    shared_index.labelled("ipaddr")
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n,))
+                   for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(shared_index.labelled("new0")), 50)
+
+    def test37Transaction(self):
+        "test transaction"
+        root = self.copyroot()
+        a = augeas.Augeas(root=root)
+
+        with a.transaction() as tx:
+            tx.set("/files/etc/hosts/1/ipaddr", "127.0.0.2")
+            tx.remove("/files/etc/hosts/2")
+            self.assertEqual(len(tx), 2)
+            self.assertEqual(a.get("/files/etc/hosts/1/ipaddr"), "127.0.0.1")
+        with open(root + "/etc/hosts") as hosts:
+            text = hosts.read()
+        self.assertTrue("127.0.0.2" in text)
+        self.assertFalse("::1" in text)
+        self.assertEqual(a.match("/augeas/python/*"), [])
+
+        before = a.dump("/files/etc/hosts")
+        # A change that fails
+        with self.assertRaises(augeas.AugeasValueError):
+            with a.transaction() as tx:
+                tx.set("/files/etc/hosts/1/ipaddr", "10.0.0.1")
+                tx.set("/files/etc/hosts/1/*", "x")
+        self.assertEqual(a.dump("/files/etc/hosts"), before)
+        # A tree that can not be saved
+        with self.assertRaises(augeas.AugeasIOError):
+            with a.transaction() as tx:
+                tx.remove("/files/etc/hosts/1/ipaddr")
+        self.assertEqual(a.dump("/files/etc/hosts"), before)
+        # The restored file matches the disk and is loaded again
+        self.assertEqual(a.plan(), [])
+        # An exception in the block
+        with self.assertRaises(ZeroDivisionError):
+            with a.transaction() as tx:
+                tx.set("/files/etc/hosts/1/ipaddr", "10.0.0.1")
+                1 / 0
+        self.assertEqual(a.get("/files/etc/hosts/1/ipaddr"), "127.0.0.2")
+        with open(root + "/etc/hosts") as hosts:
+            self.assertEqual(hosts.read(), text)
+
+        # Files the changes do not touch are not checked, and indexes are
+        # rebuilt once instead of being updated after every change
+        index = a.build_index("/files/etc/hosts")
+        a.remove("/files/etc/fstab/1/spec")
+        with a.transaction() as tx:
+            tx.set("/files/etc/hosts/1/ipaddr", "127.0.0.3")
+            tx.set("/files/etc/hosts/1/canonical", "localhost")
+        with open(root + "/etc/hosts") as hosts:
+            self.assertTrue("127.0.0.3" in hosts.read())
+        self.assertRaises(augeas.AugeasIOError, a.save)
+        self.assertEqual(index.lookup("127.0.0.3"),
+                         ["/files/etc/hosts/1/ipaddr"])
+        self.assertEqual(index.rebuilds, 2)
+        a.load()
+
+        # A failing restore does not hide the original error
+        def restore(saved):
+            raise RuntimeError("restore failed")
+        tx = a.transaction()
+        tx._restore = restore
+        tx.set("/files/etc/hosts/1/*", "x")
+        with self.assertRaises(augeas.AugeasValueError):
+            tx.commit()
+        del a
+
+    def test38LoadDict(self):
+        "test load_dict"
+        a = augeas.Augeas(root=MYROOT)
+        a.load_dict("/test/hosts", {"1": {"ipaddr": "10.0.0.1",
+                                          "canonical": "foo",
+                                          "alias": ["f", "fo"]}})
+        self.assertEqual(a.match("/test/hosts/1/*"),
+                         ["/test/hosts/1/ipaddr", "/test/hosts/1/canonical",
+                          "/test/hosts/1/alias[1]", "/test/hosts/1/alias[2]"])
+        self.assertEqual(a.get("/test/hosts/1/alias[2]"), "fo")
+        self.assertIsNone(a.get("/test/hosts"))
+
+        # Appends to existing children, keeping the order of the pairs
+        a.load_dict("/test/hosts", [("#comment", "x"),
+                                    ("2", [("ipaddr", None)])])
+        self.assertEqual(a.match("/test/hosts/*"),
+                         ["/test/hosts/1", "/test/hosts/#comment",
+                          "/test/hosts/2"])
+        self.assertEqual(a.match("/test/hosts/2/ipaddr"),
+                         ["/test/hosts/2/ipaddr"])
+
+        # A list of mappings repeats the label, an empty list makes one node
+        a.load_dict("/test/repeat", {"entry": [{"a": "1"}, {"a": "2"}],
+                                     "empty": []})
+        self.assertEqual(a.match("/test/repeat/*"),
+                         ["/test/repeat/entry[1]", "/test/repeat/entry[2]",
+                          "/test/repeat/empty"])
+        self.assertEqual(a.get("/test/repeat/entry[2]/a"), "2")
+
+        # Round trip through dump()
+        trees = a.dump("/files/etc/hosts")[0]["children"]
+        a.load_dict("/test/copy", trees)
+        self.assertEqual(a.dump("/test/copy")[0]["children"], trees)
+
+        self.assertRaises(TypeError, a.load_dict, "/test", "x")
+        del a
+
+    def test39Diff(self):
+        "test diff"
+        a = augeas.Augeas(root=MYROOT)
+        b = augeas.Augeas(root=MYROOT)
+        prefix = "/files/etc/hosts"
+        self.assertEqual(augeas.diff(a, b, prefix), [])
+
+        b.set("/files/etc/hosts/1/ipaddr", "127.0.0.2")
+        b.insert("/files/etc/hosts/1/alias[1]", "alias")
+        b.set("/files/etc/hosts/1/alias[1]", "first")
+        b.remove("/files/etc/hosts/2")
+        b.set("/files/etc/hosts/3/ipaddr", "192.168.0.1")
+        b.set("/files/etc/hosts/3/canonical", "rtr")
+        snapshot = a.dump(prefix)
+        ops = augeas.diff(a, b, prefix)
+        self.assertEqual(augeas.diff(snapshot, b.dump(prefix), prefix), ops)
+        self.assertTrue(("set", "/files/etc/hosts/1[1]/ipaddr[1]",
+                         "127.0.0.2") in ops)
+
+        for op in ops:
+            getattr(a, op[0])(*op[1:])
+        self.assertEqual(a.dump(prefix), b.dump(prefix))
+        self.assertEqual(augeas.diff(a, b, prefix), [])
+        self.assertEqual(augeas.diff([], b, prefix)[0], ("clear", prefix))
+
+        # Replaying creates valueless nodes and clears values
+        a.set("/test/node/leaf", "x")
+        b.clear("/test/node/leaf")
+        b.clear("/test/node/empty")
+        b.clear("/test/other/child")
+        ops = augeas.diff(a, b, "/test")
+        self.assertTrue(("clear", "/test/node[1]/leaf[1]") in ops)
+        for op in ops:
+            getattr(a, op[0])(*op[1:])
+        self.assertEqual(a.dump("/test"), b.dump("/test"))
+        self.assertEqual(a.get("/test/node/empty"), None)
+        self.assertEqual(a.get("/test/other/child"), None)
+        del a, b
+
+    def test40Plan(self):
+        "test plan"
+        root = self.copyroot()
+        a = augeas.Augeas(root=root)
+        self.assertEqual(a.plan(), [])
+
+        a.set("/files/etc/hosts/1/ipaddr", "127.0.0.2")
+        ifcfg = "/etc/sysconfig/network-scripts/ifcfg-eth9"
+        a.set("/files" + ifcfg + "/DEVICE", "eth9")
+        with open(root + "/etc/hosts") as hosts:
+            text = hosts.read()
+        a.enable_cache()
+        self.assertEqual(a.get("/files/etc/hosts/1/ipaddr"), "127.0.0.2")
+        changes = sorted(a.plan())
+        self.assertEqual([c.filename for c in changes],
+                         ["/etc/hosts", ifcfg])
+        hosts, new = changes
+        self.assertEqual(hosts.path, "/files/etc/hosts")
+        self.assertEqual(hosts.old, text)
+        self.assertTrue("-127.0.0.1\t" in hosts.diff)
+        self.assertTrue("+127.0.0.2\t" in hosts.diff)
+        self.assertEqual(new.old, None)
+        self.assertEqual(new.new, "DEVICE=eth9\n")
+        self.assertTrue(new.diff.startswith("--- /dev/null\n"))
+        # The cached results outlive the plan
+        self.assertEqual(a.get("/files/etc/hosts/1/ipaddr"), "127.0.0.2")
+        self.assertEqual(a.cache_info().hits, 1)
+        with open(root + "/etc/hosts") as hosts:
+            self.assertEqual(hosts.read(), text)
+        self.assertFalse(os.path.exists(root + ifcfg))
+        self.assertEqual(a.get("/augeas/save"), "overwrite")
+        del a
+
+    def test41Export(self):
+        "test to_xml, to_json, print_tree and escape_name"
+        a = augeas.Augeas(root=MYROOT)
+        xml = a.to_xml("/files/etc/hosts")
+        self.assertTrue(xml.startswith(b"<augeas"))
+        tree = a.to_xml("/files/etc/hosts", tree=True)
+        self.assertEqual(tree.find(".//node[@label='ipaddr']/value").text,
+                         "127.0.0.1")
+        self.assertEqual(json.loads(a.to_json("/files/etc/hosts")),
+                         a.dump("/files/etc/hosts"))
+
+        text = a.print_tree("/files/etc/hosts/1")
+        self.assertTrue('/files/etc/hosts/1/ipaddr = "127.0.0.1"\n' in text)
+        out = tempfile.TemporaryFile("w+")
+        a.print_tree("/files/etc/hosts/1", out)
+        out.seek(0)
+        self.assertEqual(out.read(), text)
+        out.close()
+        self.assertRaises(TypeError, a.print_tree, "/files", "out")
+
+        self.assertEqual(a.escape_name("ipaddr"), "ipaddr")
+        self.assertEqual(a.escape_name("a/b"), "a\\/b")
+        del a
+
+    def test42ParseRender(self):
+        "test parse and render"
+        a = augeas.Augeas(root=MYROOT, flags=augeas.Augeas.NO_LOAD)
+        text = b"127.0.0.1 localhost  # loopback\n"
+        tree = a.parse("Hosts.lns", text)
+        self.assertEqual([node["label"] for node in tree], ["1"])
+        self.assertEqual(tree[0]["children"][0],
+                         {"label": "ipaddr", "value": "127.0.0.1",
+                          "children": []})
+        self.assertEqual(a.parse("Hosts.lns", memoryview(text)), tree)
+        self.assertEqual(a.parse("Hosts.lns", text.decode()), tree)
+        self.assertEqual(a.match("/augeas/python/text"), [])
+
+        self.assertEqual(a.render("Hosts.lns", tree, text), text)
+        tree[0]["children"][0]["value"] = "127.0.0.2"
+        self.assertEqual(a.render("Hosts.lns", tree, text),
+                         b"127.0.0.2 localhost  # loopback\n")
+        self.assertEqual(a.render("Hosts.lns", [("1", [
+            ("ipaddr", "10.0.0.1"), ("canonical", "host")])]),
+            b"10.0.0.1\thost\n")
+
+        self.assertRaises(ValueError, a.parse, "Hosts.lns", b"127.0.0.1\n")
+        self.assertRaises(ValueError, a.parse, "Hosts.lns", b"\0")
+        self.assertRaises(TypeError, a.parse, "Hosts.lns", 42)
+        self.assertEqual(a.match("/augeas/python/text"), [])
+        del a
+
+    def test43IterArchive(self):
+        "test iter_archive"
+        def add(tar, name, data):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+        with open(MYROOT + "/etc/hosts", "rb") as fp:
+            hosts = fp.read()
+        layer = io.BytesIO()
+        with tarfile.open(fileobj=layer, mode="w:gz") as tar:
+            directory = tarfile.TarInfo("etc")
+            directory.type = tarfile.DIRTYPE
+            tar.addfile(directory)
+            add(tar, "./etc/hosts", hosts)
+            add(tar, "etc/.wh.fstab", b"")
+            add(tar, "etc/unknown.data", b"key = value\n")
+            add(tar, "etc/sysconfig/network-scripts/ifcfg-eth9",
+                b'DEVICE="eth9\n')
+        layer.seek(0)
+
+        a = augeas.Augeas(root=MYROOT, flags=augeas.Augeas.NO_LOAD)
+        entries = list(iter_archive(a, layer))
+        self.assertEqual([e.filename for e in entries],
+                         ["/etc/hosts",
+                          "/etc/sysconfig/network-scripts/ifcfg-eth9"])
+        self.assertEqual(entries[0].lens, "Hosts.lns")
+        self.assertEqual(entries[0].error, None)
+        self.assertEqual(entries[0].tree, a.parse("Hosts.lns", hosts))
+        self.assertEqual(entries[1].tree, None)
+        self.assertTrue(isinstance(entries[1].error, ValueError))
+        self.assertEqual(a.match("/files/*"), [])
+        del a
+
+    def test44LensFor(self):
+        "test lens_for"
+        a = augeas.Augeas(root=MYROOT, flags=augeas.Augeas.NO_LOAD)
+        self.assertEqual(a.lens_for("/etc/hosts"), "Hosts.lns")
+        self.assertEqual(a.lens_for("/etc/hosts.augnew"), None)
+        self.assertEqual(a.lens_for("/no/such/file"), None)
+        scripts = "/etc/sysconfig/network-scripts/"
+        a.load_file(scripts + "ifcfg-eth0")
+        lens = a.get("/augeas/files" + scripts + "ifcfg-eth0/lens")
+        self.assertEqual(a.lens_for(scripts + "ifcfg-x"),
+                         lens.lstrip("@") + ".lns")
+
+        a.clear_transforms()
+        self.assertEqual(a.lens_for("/etc/hosts"), None)
+        a.transform("Hosts", "/etc/hosts*")
+        a.transform("Hosts", "/etc/hosts.deny", excl=True)
+        a.transform("Shellvars", "/etc/*")
+        self.assertEqual(a.lens_for("/etc/hosts"), "Hosts.lns")
+        self.assertEqual(a.lens_for("/etc/hosts.deny"), "Shellvars.lns")
+        self.assertEqual(a.lens_for("/etc/sub/hosts"), None)
+        self.assertRaises(TypeError, a.lens_for, None)
+        del a
+
+    def test45ForFiles(self):
+        "test for_files"
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        files = ["/etc/hosts", "/etc/fstab", "/etc/no-lens"]
+        for attempt in range(2):
+            # The first time, the handle that compiles every module to find
+            # the transforms is returned; the second time, the transforms
+            # are read from cache_dir
+            augeas.Augeas._autoloaded.clear()
+            a = augeas.Augeas.for_files(files, root=MYROOT,
+                                        cache_dir=cache_dir)
+            self.assertEqual(sorted(a.match("/files/etc/*")),
+                             ["/files/etc/fstab", "/files/etc/hosts"])
+            self.assertEqual(sorted(a.match("/augeas/load/*")),
+                             ["/augeas/load/Fstab", "/augeas/load/Hosts"])
+            self.assertEqual(a.get("/augeas/load/Hosts/lens"), "Hosts.lns")
+            self.assertEqual(a.get("/files/etc/hosts/1/ipaddr"), "127.0.0.1")
+            a.close()
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        a = augeas.ThreadSafeAugeas.for_files(
+            ["/etc/hosts"], root=MYROOT, flags=augeas.Augeas.NO_LOAD)
+        self.assertTrue(isinstance(a, augeas.ThreadSafeAugeas))
+        self.assertEqual(a.match("/files/etc/*"), [])
+        self.assertRaises(TypeError, augeas.Augeas.for_files, "/etc/hosts")
+        del a
+
+    def test46SharedOutParameters(self):
+        "test that accessors sharing out parameters return their own results"
+        a = augeas.Augeas(root=MYROOT)
+        paths = a.match("/files/etc/hosts/*/ipaddr")
+        value = a.get(paths[0])
+        label = a.label(paths[0])
+        source = a.source(paths[0])
+        a.defvar("addrs", "/files/etc/hosts/*/ipaddr")
+        count = a.ns_count("addrs")
+        self.assertEqual([a.ns_path("addrs", i) for i in range(count)],
+                         paths)
+        self.assertEqual([a.ns_value("addrs", i) for i in range(count)],
+                         a.get_many(paths))
+        self.assertEqual(a.ns_attr("addrs", 0), (value, label, source))
+        # The index is 0 for a label that is unique among its siblings
+        self.assertEqual(a.ns_label("addrs", 1), ("ipaddr", 0))
+        a.defvar("aliases", "/files/etc/hosts/1/alias")
+        self.assertEqual([a.ns_label("aliases", i) for i in range(2)],
+                         [("alias", 1), ("alias", 2)])
+        self.assertEqual((value, label, source),
+                         ("127.0.0.1", "ipaddr", "/files/etc/hosts"))
+        del a
+
+    def test47Clear(self):
+        "test clear"
+        a = augeas.Augeas(root=MYROOT)
+        # Unlike clear(), set() stores None as an empty value
+        a.set("/raw/hosts", None)
+        self.assertIsNotNone(a.get("/raw/hosts"))
+        a.clear("/raw/hosts")
+        self.assertIsNone(a.get("/raw/hosts"))
+        a.clear("/raw/new/node")
+        self.assertEqual(a.dump("/raw/new"),
+                         [{"label": "new", "value": None,
+                           "children": [{"label": "node", "value": None,
+                                         "children": []}]}])
+        self.assertRaises(ValueError, a.clear, "/files/etc/hosts/*")
+        del a
+
     def testClose(self):
         a = augeas.Augeas(root=MYROOT)
         a.close()